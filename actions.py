@@ -0,0 +1,177 @@
+"""Side effects that run when a conversation enters or leaves a call tree node.
+
+A node lists the actions to run under `on_enter` and `on_exit` in its tree
+definition, by name or as `{name, critical, timeout}`. Actions are registered
+here with `@action`, and can be coroutine functions or plain functions, which
+run in a worker thread so they can't block the event loop.
+
+Critical actions are awaited before the webhook's response is streamed, so
+only use them for work the response can't go out without. Everything else
+runs in the background on an ActionRunner, which caps how many actions are in
+flight and how long each can take, so a slow downstream system never delays
+the bot.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = float(os.getenv("ACTION_TIMEOUT", "5"))
+
+# Action name -> (function, critical, timeout).
+ACTIONS = {}
+
+
+def action(name, critical=False, timeout=None):
+    """Registers a function as the action `name`."""
+
+    def register(fn):
+        ACTIONS[name] = (fn, critical, timeout)
+        return fn
+
+    return register
+
+
+class NodeAction:
+    """An action as listed on a node, with its tree's overrides applied."""
+
+    __slots__ = ("name", "fn", "critical", "timeout")
+
+    def __init__(self, name, fn, critical, timeout):
+        self.name = name
+        self.fn = fn
+        self.critical = critical
+        self.timeout = timeout
+
+    @classmethod
+    def from_definition(cls, definition):
+        """Builds a NodeAction from an `on_enter`/`on_exit` list entry."""
+
+        if isinstance(definition, str):
+            definition = {"name": definition}
+        name = definition["name"]
+        if name not in ACTIONS:
+            raise ValueError(f"Unknown action: {name}")
+        fn, critical, timeout = ACTIONS[name]
+        return cls(
+            name,
+            fn,
+            definition.get("critical", critical),
+            definition.get("timeout", timeout or DEFAULT_TIMEOUT),
+        )
+
+
+class ActionContext:
+    """What an action is told about the transition that triggered it.
+
+    Background actions can run after later webhooks have moved the call tree
+    on, so they get a copy of its values rather than the call tree itself.
+    """
+
+    __slots__ = ("conversation_id", "tree", "node", "event", "arguments", "values", "campaign")
+
+    def __init__(self, conversation_id, call_tree, node, event=None, arguments=None):
+        self.conversation_id = conversation_id
+        self.tree = call_tree.tree_name
+        self.node = node
+        self.event = event
+        self.arguments = arguments or {}
+        self.values = call_tree.values
+        self.campaign = call_tree.campaign
+
+
+class ActionRunner:
+    """Runs node actions, awaiting critical ones and running the rest as
+    background tasks, at most `max_background` at a time.
+
+    Background actions past that limit are dropped rather than queued, so a
+    stalled downstream system can't pile up work. Every action's outcome (ok,
+    error, timeout or dropped) is counted and errors are logged, never raised.
+    """
+
+    def __init__(self, max_background=None):
+        self.max_background = max_background or int(
+            os.getenv("ACTION_MAX_BACKGROUND", "100")
+        )
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._tasks)
+
+    async def run(self, actions, context):
+        """Starts `actions` for a transition, returning once the critical ones
+        have finished."""
+
+        critical = []
+        for a in actions:
+            if a.critical:
+                critical.append(self._run(a, context))
+            elif len(self._tasks) >= self.max_background:
+                logger.warning("Dropped action %s on %s", a.name, context.node)
+                metrics.action_outcomes.inc(a.name, "dropped")
+            else:
+                task = asyncio.create_task(self._run(a, context))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        if critical:
+            await asyncio.gather(*critical)
+
+    async def _run(self, a, context):
+        t0 = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(a.fn):
+                await asyncio.wait_for(a.fn(context), a.timeout)
+            else:
+                # The thread can't be stopped, but the timeout stops waiting.
+                await asyncio.wait_for(asyncio.to_thread(a.fn, context), a.timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Action %s on %s timed out", a.name, context.node)
+            outcome = "timeout"
+        except Exception:
+            logger.exception("Action %s on %s failed", a.name, context.node)
+            outcome = "error"
+        else:
+            outcome = "ok"
+        metrics.action_seconds.observe(time.perf_counter() - t0, a.name)
+        metrics.action_outcomes.inc(a.name, outcome)
+
+    async def stop(self, timeout=5):
+        """Gives background actions `timeout` seconds to finish, then cancels
+        the rest."""
+
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+@action("notify_staff")
+async def notify_staff(context):
+    """Tells staff a call needs a human to follow up, by POSTing it to
+    STAFF_WEBHOOK_URL, or in the log if that isn't set."""
+
+    notification = {
+        "conversation_id": context.conversation_id,
+        "tree": context.tree,
+        "node": context.node,
+        "event": context.event,
+        "arguments": context.arguments,
+        "campaign": context.campaign,
+        **context.values,
+    }
+    url = os.getenv("STAFF_WEBHOOK_URL")
+    if not url:
+        logger.info("Staff follow-up needed", extra={"fields": notification})
+        return
+    import aiohttp
+
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, json=notification) as r:
+            r.raise_for_status()
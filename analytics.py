@@ -0,0 +1,240 @@
+"""Funnel, drop-off and dwell-time statistics over the transition log that
+DispositionSink writes.
+
+For each call tree page, reports how many conversations reached it, how many
+stopped there without reaching a final page, and percentiles of how long
+conversations stayed on it, optionally broken down by campaign or office.
+The log is loaded into numpy columns and aggregated in a few vectorized
+passes, so millions of transitions take seconds.
+
+    python -m analytics --by campaign --since 1729000000
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from dispositions import connect
+
+PERCENTILES = (50, 90, 99)
+GROUPS = ("campaign", "office_name", "tree")
+
+
+def load(path=None, by=None, since=None, until=None, campaign=None, office=None, tree=None):
+    """Reads the transitions of matching conversations as numpy columns,
+    sorted by conversation and time, or returns None if there are none.
+
+    Conversations are selected by their start: `since` and `until` bound when
+    they started, and campaign, office and tree are the ones they started on.
+    Only the `by` column is read besides the ones every statistic needs.
+    """
+
+    # Every row of a conversation has the same campaign, office and tree, and
+    # none is older than its start, so these filters can go to SQLite.
+    where, params = [], []
+    for column, value in (
+        ("campaign", campaign),
+        ("office_name", office),
+        ("tree", tree),
+    ):
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if since is not None:
+        where.append("at >= ?")
+        params.append(since)
+    names = ["conversation_id", "COALESCE(source, '')", "target"]
+    if by:
+        names.append(f"COALESCE({by}, '')")
+    sql = f"SELECT {', '.join(names)}, final, at FROM transitions"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    db = connect(path or os.getenv("DISPOSITIONS_DB", "dispositions.db"))
+    try:
+        rows = db.execute(sql, params).fetchall()
+    finally:
+        db.close()
+    if not rows:
+        return None
+
+    values = zip(*rows)
+    columns = {
+        name: np.array(next(values), dtype=str)
+        for name in ("conversation", "source", "target", *([by] if by else []))
+    }
+    columns["final"] = np.array(next(values), dtype=bool)
+    columns["at"] = np.array(next(values), dtype=float)
+    conversation = np.unique(columns["conversation"], return_inverse=True)[1]
+    order = np.lexsort((columns["at"], conversation))
+    columns = {name: column[order] for name, column in columns.items()}
+    conversation = conversation[order]
+
+    # Keep conversations whose first row is their start, within the window.
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = conversation[1:] != conversation[:-1]
+    keep = first & (columns["source"] == "")
+    if until is not None:
+        keep &= columns["at"] < until
+    keep = keep[first][np.cumsum(first) - 1]
+    if not keep.any():
+        return None
+    return {name: column[keep] for name, column in columns.items()}
+
+
+def aggregate(columns, by=None, in_progress_after=None):
+    """Computes per-page statistics from `load`'s columns.
+
+    Conversations whose last transition is after `in_progress_after` may still
+    be going, so they aren't counted as stopping on their current page.
+    Returns {group: {"conversations": n, "nodes": {node: {...}}}}.
+    """
+
+    if columns is None:
+        return {}
+    at = columns["at"]
+    nodes, target = np.unique(columns["target"], return_inverse=True)
+    node_count = len(nodes)
+    has_source = columns["source"] != ""
+    source = np.minimum(np.searchsorted(nodes, columns["source"]), node_count - 1)
+    if by:
+        groups, group = np.unique(columns[by], return_inverse=True)
+    else:
+        groups, group = np.array(["all"]), np.zeros(len(at), dtype=int)
+    group_count = len(groups)
+
+    # Rows are sorted by conversation then time, so a row's previous row is
+    # the previous transition of the same conversation unless it's the first.
+    first = np.ones(len(at), dtype=bool)
+    first[1:] = columns["conversation"][1:] != columns["conversation"][:-1]
+    last = np.ones(len(at), dtype=bool)
+    last[:-1] = first[1:]
+    conversation = np.cumsum(first) - 1
+    # Conversations are grouped by their first row's campaign or office.
+    group = group[first][conversation]
+
+    def per_node(mask, key_nodes):
+        key = group[mask] * node_count + key_nodes[mask]
+        return np.bincount(key, minlength=group_count * node_count).reshape(
+            group_count, node_count
+        )
+
+    started = np.bincount(group[first], minlength=group_count)
+    # A conversation reaching the same page twice counts once.
+    pair = conversation.astype(np.int64) * node_count + target
+    _, unique_rows = np.unique(pair, return_index=True)
+    reached_mask = np.zeros(len(at), dtype=bool)
+    reached_mask[unique_rows] = True
+    reached = per_node(reached_mask, target)
+
+    stopped_mask = last & ~columns["final"]
+    if in_progress_after is not None:
+        stopped_mask &= at <= in_progress_after
+    stopped = per_node(stopped_mask, target)
+
+    # Time spent on the source page of every transition.
+    moved = has_source & ~first
+    previous_at = np.empty_like(at)
+    previous_at[1:] = at[:-1]
+    dwell = (at - previous_at)[moved]
+    dwell_key = group[moved] * node_count + source[moved]
+    order = np.lexsort((dwell, dwell_key))
+    dwell, dwell_key = dwell[order], dwell_key[order]
+    keys = np.arange(group_count * node_count)
+    starts = np.searchsorted(dwell_key, keys, side="left")
+    ends = np.searchsorted(dwell_key, keys, side="right")
+    counts = ends - starts
+    percentiles = {}
+    for p in PERCENTILES:
+        # Nearest-rank percentile of each (group, node) run of sorted dwells.
+        rank = np.maximum(np.ceil(p / 100 * counts).astype(int) - 1, 0)
+        index = np.minimum(starts + rank, max(len(dwell) - 1, 0))
+        values = dwell[index] if len(dwell) else np.zeros(len(keys))
+        percentiles[p] = np.where(counts > 0, values, np.nan).reshape(
+            group_count, node_count
+        )
+    counts = counts.reshape(group_count, node_count)
+
+    result = {}
+    for g, name in enumerate(groups):
+        stats = {}
+        for n, node in enumerate(nodes):
+            if not reached[g, n]:
+                continue
+            stats[str(node)] = {
+                "reached": int(reached[g, n]),
+                "reached_pct": round(100 * reached[g, n] / started[g], 1),
+                "stopped": int(stopped[g, n]),
+                "dwell_count": int(counts[g, n]),
+                **{
+                    f"dwell_p{p}": None
+                    if np.isnan(percentiles[p][g, n])
+                    else round(float(percentiles[p][g, n]), 3)
+                    for p in PERCENTILES
+                },
+            }
+        result[str(name) or "none"] = {"conversations": int(started[g]), "nodes": stats}
+    return result
+
+
+def stats(path=None, by=None, in_progress_after=None, **filters):
+    """Loads the transition log and aggregates it; see `load` and `aggregate`."""
+
+    return aggregate(load(path, by, **filters), by, in_progress_after)
+
+
+def print_stats(result):
+    for name, group in result.items():
+        print(f"{name}: {group['conversations']} conversations")
+        print(
+            f"  {'node':<12}{'reached':>9}{'%':>7}{'stopped':>9}"
+            + "".join(f"{f'p{p} s':>9}" for p in PERCENTILES)
+        )
+        for node, s in group["nodes"].items():
+            dwells = "".join(
+                f"{s[f'dwell_p{p}']:9.1f}" if s[f"dwell_p{p}"] is not None else f"{'-':>9}"
+                for p in PERCENTILES
+            )
+            print(
+                f"  {node:<12}{s['reached']:9d}{s['reached_pct']:7.1f}"
+                f"{s['stopped']:9d}{dwells}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", help="defaults to DISPOSITIONS_DB or dispositions.db")
+    parser.add_argument("--by", choices=GROUPS, help="break the stats down by this")
+    parser.add_argument("--campaign")
+    parser.add_argument("--office")
+    parser.add_argument("--tree")
+    parser.add_argument(
+        "--since", type=float, help="only conversations started after this unix time"
+    )
+    parser.add_argument("--until", type=float)
+    parser.add_argument(
+        "--max-duration",
+        type=float,
+        default=float(os.getenv("BOT_MAX_DURATION", "300")),
+        help="conversations active this recently may still be going",
+    )
+    parser.add_argument("--json", action="store_true", help="print JSON")
+    args = parser.parse_args()
+    result = stats(
+        args.db,
+        by=args.by,
+        in_progress_after=time.time() - args.max_duration,
+        since=args.since,
+        until=args.until,
+        campaign=args.campaign,
+        office=args.office,
+        tree=args.tree,
+    )
+    if args.json:
+        print(json.dumps(result, indent=2))
+    elif not result:
+        print("No conversations found")
+    else:
+        print_stats(result)
@@ -0,0 +1,97 @@
+"""Checks that slow node actions don't delay webhook responses unless they're
+critical.
+
+Copies the default tree to a scratch trees directory with a `slow_downstream`
+action (a coroutine that sleeps --delay seconds) and a blocking one (a plain
+function that sleeps) on entering node_3, then times the confirmed_office
+webhook in-process with no actions, with both in the background, and with
+the coroutine marked critical.
+
+    python -m benchmarks.actions --delay 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+import yaml
+
+import call_tree
+from actions import action
+from benchmarks.webhook import BODY, call
+
+CASES = {
+    "no actions": [],
+    "background": ["slow_downstream", "blocking_downstream"],
+    "critical": [{"name": "slow_downstream", "critical": True}],
+}
+
+
+def write_trees(directory):
+    source = os.path.join(call_tree.TREES_DIR, f"{call_tree.DEFAULT_TREE}.yaml")
+    with open(source) as f:
+        definition = yaml.safe_load(f)
+    for i, actions in enumerate(CASES.values()):
+        definition["nodes"]["node_3"]["on_enter"] = actions
+        with open(os.path.join(directory, f"actions_{i}.yaml"), "w") as f:
+            yaml.safe_dump(definition, f)
+
+
+async def run(number, delay):
+    import main as server
+
+    @action("slow_downstream")
+    async def slow_downstream(context):
+        await asyncio.sleep(delay)
+
+    @action("blocking_downstream")
+    def blocking_downstream(context):
+        time.sleep(delay)
+
+    body = json.dumps(BODY).encode()
+    print(f"{'node_3 actions':<16}{'mean ms':>10}{'max ms':>10}")
+    ok = True
+    for i, name in enumerate(CASES):
+        tree = call_tree.get_call_tree(f"actions_{i}")
+        timings = []
+        for _ in range(number):
+            conversation_id = str(uuid.uuid4())
+            await server.conversations.create(
+                conversation_id,
+                tree("Alice Adams", "Dr. Carlson's office", "knee replacement", ["Knee X-ray"]),
+            )
+            t0 = time.perf_counter()
+            await call(server.app, "/webhook", body, conversation_id)
+            timings.append((time.perf_counter() - t0) * 1000)
+        print(f"{name:<16}{sum(timings) / number:>10.2f}{max(timings):>10.2f}")
+        if name == "background":
+            ok = max(timings) < delay * 1000
+    await server.action_runner.stop()
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.2)
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+    scratch = tempfile.mkdtemp()
+    try:
+        write_trees(scratch)
+        call_tree.TREES_DIR = scratch
+        ok = asyncio.run(run(args.number, args.delay))
+    finally:
+        shutil.rmtree(scratch)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
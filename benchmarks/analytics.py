@@ -0,0 +1,78 @@
+"""Times analytics.stats over a synthetic transition log.
+
+Writes --conversations random walks through the call tree, spread over a few
+campaigns and offices, to a scratch SQLite database, then times loading and
+aggregating them.
+
+    python -m benchmarks.analytics --conversations 500000
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import uuid
+
+import analytics
+from benchmarks.load import random_path
+from call_tree import get_call_tree
+from dispositions import INSERTS, connect
+
+
+def synthetic_rows(tree, count, rng):
+    states = {s.id: s for s in tree.states}
+    initial = next(s for s in tree.states if s.initial)
+    for i in range(count):
+        conversation_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        campaign = f"campaign_{i % 5}.csv"
+        office = f"Office {rng.randrange(200)}"
+        at = 1700000000 + i
+        yield (conversation_id, tree.tree_name, campaign, office, None,
+               initial.id, None, 0, at)
+        state = initial
+        # Some calls hang up part way through.
+        path = random_path(tree, rng)[: rng.randrange(1, 5)]
+        for event in path:
+            target = next(t.target for t in state.transitions if t.event == event)
+            at += rng.expovariate(1 / 20)
+            yield (conversation_id, tree.tree_name, campaign, office, state.id,
+                   target.id, event, int(target.final), at)
+            state = states[target.id]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    tree = get_call_tree()
+    tree = getattr(tree, "definition", tree)
+    with tempfile.TemporaryDirectory() as scratch:
+        path = os.path.join(scratch, "transitions.db")
+        db = connect(path)
+        with db:
+            db.executemany(
+                INSERTS["transitions"],
+                synthetic_rows(tree, args.conversations, random.Random(args.seed)),
+            )
+        transitions = db.execute("SELECT COUNT(*) FROM transitions").fetchone()[0]
+        db.close()
+
+        t0 = time.perf_counter()
+        columns = analytics.load(path)
+        t1 = time.perf_counter()
+        analytics.aggregate(columns)
+        t2 = time.perf_counter()
+        result = analytics.stats(path, by="office_name")
+        t3 = time.perf_counter()
+
+    print(f"transitions          {transitions}")
+    print(f"load                 {t1 - t0:8.2f} s")
+    print(f"aggregate            {t2 - t1:8.2f} s")
+    print(f"stats by office      {t3 - t2:8.2f} s ({len(result)} offices)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Compares building each /start's bot config as a dict and JSON-encoding it,
+as every launch used to, with splicing per-call values into the pre-encoded
+template.
+
+Checks both produce the same config, then reports the CPU time and the peak
+memory allocated per launch.
+
+    python -m benchmarks.bot_config
+"""
+
+import argparse
+import json
+import sys
+import timeit
+import tracemalloc
+import uuid
+
+from bot_config import bot_config, encode_bot_config
+from call_tree import get_call_tree
+from sse import fill
+
+
+def build_bot_config(conversation_id, call_tree, max_duration, run_on_config, extra=None):
+    """The same config as `encode_bot_config`, built as a dict like every
+    launch used to."""
+
+    config = fill(
+        bot_config(type(call_tree), max_duration),
+        {**call_tree.values, "conversation_id": conversation_id},
+    )
+    config["config"][2]["options"][3]["value"] = run_on_config
+    return {**config, **(extra or {})}
+
+
+def dict_path(conversation_id, ct):
+    config = build_bot_config(
+        conversation_id, ct, 300, False, {"dialout_settings": [{"phoneNumber": "+1"}]}
+    )
+    return json.dumps(config).encode()
+
+
+def template_path(conversation_id, ct):
+    return encode_bot_config(
+        conversation_id, ct, 300, False, {"dialout_settings": [{"phoneNumber": "+1"}]}
+    )
+
+
+def peak_allocation(fn, *args):
+    fn(*args)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    ct = get_call_tree()(
+        patient_name='Zoë "Z" Adams',
+        office_name="Dr. Carlson's office",
+        surgery="knee replacement",
+        documents=["Knee X-ray taken on October 8", "Lab tests performed on October 10"],
+    )
+    conversation_id = str(uuid.uuid4())
+    same = json.loads(dict_path(conversation_id, ct)) == json.loads(
+        template_path(conversation_id, ct)
+    )
+    print(f"same config          {'yes' if same else 'NO'}")
+    print(f"config size          {len(template_path(conversation_id, ct))} bytes")
+    print("path        us/launch   peak alloc/launch")
+    for name, fn in (("dict", dict_path), ("template", template_path)):
+        us = timeit.timeit(lambda: fn(conversation_id, ct), number=args.number)
+        us = us / args.number * 1e6
+        peak = peak_allocation(fn, conversation_id, ct)
+        print(f"{name:<10}{us:11.2f}{peak:14d} bytes")
+    sys.exit(0 if same else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Checks that the memory and Redis conversation stores behave the same, and
+times a webhook's `get` and `save` on each. Redis is stood in for by
+fakeredis, so no server is needed (`pip install fakeredis`).
+
+Covers create, get, save, touch and delete, and a conversation forgotten
+between a webhook's `get` and its `save` (expired, or ended by another
+worker), which must stay forgotten rather than come back without a TTL.
+
+    python -m benchmarks.conversation_store --number 5000
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+import fakeredis.aioredis
+
+from call_tree import get_call_tree
+from conversations import MemoryConversationStore, RedisConversationStore
+
+PATIENT = ("Alice Adams", "Dr. Carlson's office", "knee replacement", ["Knee X-ray"])
+TTL = 3600
+
+
+async def check(store):
+    """Returns a list of what the store got wrong."""
+
+    failures = []
+    ct = get_call_tree()(*PATIENT)
+    await store.create("a", ct)
+    got = await store.get("a")
+    if got is None or got.current_state.id != ct.current_state.id:
+        failures.append("get after create")
+
+    got.send("confirmed_office")
+    await store.save("a", got)
+    saved = await store.get("a")
+    if saved is None or saved.current_state.id != got.current_state.id:
+        failures.append("get after save")
+
+    await store.touch("a", saved)
+    if await store.get("a") is None:
+        failures.append("get after touch")
+
+    await store.delete("a")
+    if await store.get("a") is not None:
+        failures.append("get after delete")
+
+    await store.touch("a", saved)
+    if await store.get("a") is None:
+        failures.append("touch after delete doesn't store the tree again")
+    await store.delete("a")
+
+    # Forgotten between a webhook's get and save.
+    await store.create("b", ct)
+    got = await store.get("b")
+    await store.delete("b")
+    await store.save("b", got)
+    if await store.get("b") is not None:
+        failures.append("save brings back a deleted conversation")
+
+    if isinstance(store, RedisConversationStore):
+        await store.create("c", ct)
+        await store.save("c", ct)
+        if not 0 < await store.client.ttl(store.prefix + "c") <= TTL:
+            failures.append("save loses the TTL")
+        await store.delete("c")
+    return failures
+
+
+async def time_webhooks(store, number):
+    """Mean us for a webhook's get and save of one conversation."""
+
+    await store.create("t", get_call_tree()(*PATIENT))
+    t0 = time.perf_counter()
+    for _ in range(number):
+        await store.save("t", await store.get("t"))
+    return (time.perf_counter() - t0) / number * 1e6
+
+
+async def run(number):
+    stores = {
+        "memory": MemoryConversationStore(TTL),
+        "redis (fakeredis)": RedisConversationStore(
+            TTL, client=fakeredis.aioredis.FakeRedis()
+        ),
+    }
+    ok = True
+    print(f"{'store':<20}{'get + save us':>14}  checks")
+    for name, store in stores.items():
+        failures = await check(store)
+        us = await time_webhooks(store, number)
+        print(f"{name:<20}{us:>14.1f}  {', '.join(failures) or 'ok'}")
+        ok = ok and not failures
+        await store.close()
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args(argv)
+    sys.exit(0 if asyncio.run(run(args.number)) else 1)
+
+
+if __name__ == "__main__":
+    main()
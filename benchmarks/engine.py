@@ -0,0 +1,122 @@
+"""Checks that the table-driven engine (engine.py) behaves exactly like the
+python-statemachine CallTree, then compares their construction and send cost.
+
+The check starts both engines on every node and in every language, drives
+them through every sequence of events up to --depth long (including events
+the tree doesn't define), and compares the node, history, snapshot, SSE
+bytes and any error after each step. It exits non-zero on a mismatch.
+
+    python -m benchmarks.engine --tree records_request
+"""
+
+import argparse
+import itertools
+import sys
+import timeit
+
+from call_tree import get_call_tree
+from engine import compile_tree
+
+PATIENT = (
+    "Alice Adams",
+    "Dr. Carlson's office",
+    'knee "replacement"',
+    ["Knee X-ray taken on October 8", "Lab tests performed on October 10"],
+)
+
+
+def observe(ct):
+    return (
+        ct.current_state.id,
+        ct.current_state.final,
+        list(ct.history),
+        ct.to_bytes(),
+        b"".join(ct.sse_events()),
+        ct.messages,
+    )
+
+
+def step(ct, event):
+    try:
+        ct.send(event)
+    except Exception as e:
+        return type(e).__name__, str(e)
+    return None
+
+
+def differences(reference, table, depth):
+    """Yields a description of every way the two engines disagree."""
+
+    events = sorted({t.event for s in reference.states for t in s.transitions})
+    events.append("not_an_event")
+    starts = [None] + [s.id for s in reference.states]
+    for language, state in itertools.product(reference.node_events, starts):
+        for path in itertools.product(events, repeat=depth):
+            a = reference(*PATIENT, state=state, started_at=1.0, language=language)
+            b = table(*PATIENT, state=state, started_at=1.0, language=language)
+            where = f"{language} from {state or 'initial'}"
+            if observe(a) != observe(b):
+                yield f"{where}: differs before any event"
+                break
+            for i, event in enumerate(path):
+                error_a, error_b = step(a, event), step(b, event)
+                if error_a != error_b:
+                    yield f"{where} via {path[:i + 1]}: {error_a} != {error_b}"
+                    break
+                if observe(a) != observe(b):
+                    yield f"{where} via {path[:i + 1]}: state differs"
+                    break
+                restored = type(b).from_bytes(b.to_bytes())
+                if observe(restored) != observe(a):
+                    yield f"{where} via {path[:i + 1]}: snapshot differs"
+                    break
+
+
+def bench(cls, number):
+    path = []
+    state = next(s for s in cls.states if s.initial)
+    while state.transitions:
+        transition = next(iter(state.transitions))
+        path.append(transition.event)
+        state = transition.target
+
+    def construct():
+        cls(*PATIENT)
+
+    def walk():
+        ct = cls(*PATIENT)
+        for event in path:
+            ct.send(event)
+
+    construct_us = timeit.timeit(construct, number=number) / number * 1e6
+    walk_us = timeit.timeit(walk, number=number) / number * 1e6
+    send_us = (walk_us - construct_us) / max(len(path), 1)
+    return construct_us, send_us
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tree", help="call tree to check (default: CALL_TREE)")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    reference = get_call_tree(args.tree)
+    if not hasattr(reference, "definition"):
+        table = compile_tree(reference)
+    else:
+        reference, table = reference.definition, reference
+
+    problems = list(itertools.islice(differences(reference, table, args.depth), 10))
+    for problem in problems:
+        print(f"MISMATCH {problem}")
+    print(f"differential check   {'FAILED' if problems else 'ok'}")
+
+    for name, cls in (("statemachine", reference), ("table", table)):
+        construct_us, send_us = bench(cls, args.number)
+        print(f"{name:<13} construct {construct_us:8.2f} us   send {send_us:6.2f} us")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
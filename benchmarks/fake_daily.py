@@ -0,0 +1,62 @@
+"""A local stand-in for the Daily Bots /bots/start API.
+
+It accepts any bot config, waits `latency` seconds like the real API would,
+and returns a room URL whose last path segment is the conversation id from
+the config's webhook headers, so load drivers can address webhooks to it.
+
+    python -m benchmarks.fake_daily --port 8765
+    BOT_START_URL=http://localhost:8765/bots/start uvicorn main:app
+"""
+
+import argparse
+import asyncio
+import random
+
+from aiohttp import web
+
+
+def make_app(latency=0.05, fail_rate=0.0):
+    app = web.Application()
+    app["started"] = 0
+
+    async def start(request):
+        bot_config = await request.json()
+        await asyncio.sleep(latency)
+        if random.random() < fail_rate:
+            return web.Response(status=503, text="No bot workers available")
+        app["started"] += 1
+        conversation_id = bot_config["webhook_tools"]["*"]["custom_headers"][
+            "conversation-id"
+        ]
+        return web.json_response(
+            {
+                "room_url": f"https://fake.daily.co/{conversation_id}",
+                "token": "fake-token",
+            }
+        )
+
+    app.router.add_post("/bots/start", start)
+    return app
+
+
+async def serve(port, latency=0.05, fail_rate=0.0):
+    """Starts the fake API in the running event loop and returns its runner."""
+
+    runner = web.AppRunner(make_app(latency, fail_rate), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    web.run_app(
+        make_app(args.latency, args.fail_rate),
+        host="127.0.0.1",
+        port=args.port,
+        access_log=None,
+    )
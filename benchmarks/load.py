@@ -0,0 +1,262 @@
+"""Load test for /start and /webhook against a local Daily Bots stand-in.
+
+Starts the fake bots API and a uvicorn server, then runs N conversations
+that each walk a random path through the call tree, and reports /start and
+/webhook latency percentiles, SSE time-to-first-byte and time until the
+spoken line arrives, webhook throughput and the server's RSS growth.
+
+    python -m benchmarks.load --conversations 1000 --concurrency 100
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+from benchmarks import fake_daily
+from call_tree import get_call_tree
+from sse import CLOSE
+
+SAY = b'"action": "say"'
+
+
+def random_path(tree, rng):
+    """Picks a random sequence of events that walks a tree to a final node."""
+
+    state = next(s for s in tree.states if s.initial)
+    path = []
+    while not state.final:
+        transition = rng.choice(list(state.transitions))
+        path.append(transition.event)
+        state = transition.target
+    return path
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+class Results:
+    def __init__(self):
+        self.start = []
+        self.webhook = []
+        self.ttfb = []
+        self.say = []
+        self.errors = []
+        self.rss = []
+        self.elapsed = 0.0
+
+    def summary(self):
+        return {
+            "conversations": len(self.start),
+            "webhooks": len(self.webhook),
+            "errors": len(self.errors),
+            "elapsed_s": self.elapsed,
+            "webhooks_per_s": len(self.webhook) / self.elapsed if self.elapsed else 0,
+            "start_p50_ms": percentile(self.start, 50) * 1000,
+            "start_p99_ms": percentile(self.start, 99) * 1000,
+            "webhook_p50_ms": percentile(self.webhook, 50) * 1000,
+            "webhook_p99_ms": percentile(self.webhook, 99) * 1000,
+            "ttfb_p50_ms": percentile(self.ttfb, 50) * 1000,
+            "ttfb_p99_ms": percentile(self.ttfb, 99) * 1000,
+            "say_p50_ms": percentile(self.say, 50) * 1000,
+            "say_p99_ms": percentile(self.say, 99) * 1000,
+            "rss_start_mb": self.rss[0] if self.rss else float("nan"),
+            "rss_end_mb": self.rss[-1] if self.rss else float("nan"),
+            "rss_peak_mb": max(self.rss) if self.rss else float("nan"),
+        }
+
+    def print(self):
+        s = self.summary()
+        print(f"conversations  {s['conversations']} ({s['errors']} errors)")
+        print(
+            f"webhooks       {s['webhooks']} in {s['elapsed_s']:.1f}s "
+            f"({s['webhooks_per_s']:.1f}/s)"
+        )
+        for name, key in (
+            ("/start", "start"),
+            ("/webhook", "webhook"),
+            ("SSE TTFB", "ttfb"),
+            ("SSE say", "say"),
+        ):
+            print(
+                f"{name:<15}p50 {s[key + '_p50_ms']:7.2f} ms   "
+                f"p99 {s[key + '_p99_ms']:7.2f} ms"
+            )
+        print(
+            f"server RSS     start {s['rss_start_mb']:.1f} MB   "
+            f"end {s['rss_end_mb']:.1f} MB   peak {s['rss_peak_mb']:.1f} MB   "
+            f"growth {s['rss_end_mb'] - s['rss_start_mb']:+.1f} MB"
+        )
+        for error in self.errors[:5]:
+            print(f"  error: {error}")
+
+
+async def conversation(session, base_url, path, think, results):
+    t0 = time.perf_counter()
+    async with session.post(f"{base_url}/start", json={"dialout": "+15555550100"}) as r:
+        if r.status != 200:
+            results.errors.append(f"/start {r.status}: {await r.text()}")
+            return
+        data = await r.json()
+    results.start.append(time.perf_counter() - t0)
+    conversation_id = data["room_url"].rsplit("/", 1)[1]
+
+    for i, event in enumerate(path):
+        await asyncio.sleep(think * random.random() * 2)
+        t0 = time.perf_counter()
+        async with session.post(
+            f"{base_url}/webhook",
+            json={
+                "function_name": event,
+                "tool_call_id": f"{conversation_id}-{i}",
+                "arguments": {},
+            },
+            headers={"conversation-id": conversation_id},
+        ) as r:
+            body = b""
+            spoke = False
+            async for chunk in r.content.iter_any():
+                if not body:
+                    results.ttfb.append(time.perf_counter() - t0)
+                body += chunk
+                if not spoke and SAY in body:
+                    results.say.append(time.perf_counter() - t0)
+                    spoke = True
+        results.webhook.append(time.perf_counter() - t0)
+        if r.status != 200 or not body.endswith(CLOSE):
+            results.errors.append(f"/webhook {event} {r.status}: {body[:200]!r}")
+            return
+
+
+async def sample_rss(pid, results, interval=0.5):
+    while True:
+        results.rss.append(rss_mb(pid))
+        await asyncio.sleep(interval)
+
+
+async def wait_until_up(session, base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(f"{base_url}/") as r:
+                if r.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Server at {base_url} didn't start")
+        await asyncio.sleep(0.2)
+
+
+def start_server(port, daily_port, workers=1, env=None):
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--port", str(port),
+            "--workers", str(workers),
+            "--log-level", "warning",
+        ],
+        env={
+            **os.environ,
+            "BOT_START_URL": f"http://127.0.0.1:{daily_port}/bots/start",
+            "DAILY_API_KEY": "fake",
+            **(env or {}),
+        },
+        stdout=subprocess.DEVNULL,
+    )
+
+
+async def run(args, start_daily=True):
+    tree = get_call_tree(args.tree)
+    rng = random.Random(args.seed)
+    paths = [random_path(tree, rng) for _ in range(args.conversations)]
+    results = Results()
+
+    daily = None
+    if start_daily:
+        daily = await fake_daily.serve(args.daily_port, latency=args.daily_latency)
+    server = None
+    base_url = args.url
+    if not base_url:
+        server = start_server(args.port, args.daily_port, args.workers)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        try:
+            await wait_until_up(session, base_url)
+            pid = server.pid if server else args.pid
+            sampler = asyncio.create_task(sample_rss(pid, results)) if pid else None
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def bounded(path):
+                async with semaphore:
+                    await conversation(session, base_url, path, args.think, results)
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(bounded(p) for p in paths))
+            results.elapsed = time.perf_counter() - t0
+            if sampler:
+                results.rss.append(rss_mb(pid))
+                sampler.cancel()
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+            if daily:
+                await daily.cleanup()
+    return results
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument(
+        "--think", type=float, default=0.0,
+        help="average seconds between a conversation's webhooks",
+    )
+    parser.add_argument("--tree", help="call tree to walk (default: CALL_TREE)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--daily-port", type=int, default=8765)
+    parser.add_argument("--daily-latency", type=float, default=0.05)
+    parser.add_argument(
+        "--url", help="test an already running server instead of starting one"
+    )
+    parser.add_argument("--pid", type=int, help="pid of --url's server, for RSS")
+    parser.add_argument("--json", help="also write the results to this file")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    results = asyncio.run(run(args))
+    results.print()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results.summary(), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
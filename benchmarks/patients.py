@@ -0,0 +1,92 @@
+"""Times looking up patients at call start, against a SQLite patient database
+that answers after --latency seconds, like a remote scheduling system.
+
+Compares looking each patient up when its call starts with prefetching them
+ahead of time, and checks that --concurrency lookups started at once are
+coalesced into a single fetch.
+
+    python -m benchmarks.patients --latency 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from patients import PatientCache, SQLitePatientProvider, connect
+
+
+class RemoteProvider(SQLitePatientProvider):
+    def __init__(self, path, latency):
+        super().__init__(path)
+        self.latency = latency
+        self.fetches = 0
+
+    async def fetch(self, phones):
+        self.fetches += 1
+        await asyncio.sleep(self.latency)
+        return await super().fetch(phones)
+
+
+def phone(i):
+    return f"+1555{i:07d}"
+
+
+async def run(path, args):
+    provider = RemoteProvider(path, args.latency)
+
+    cache = PatientCache(provider)
+    t0 = time.perf_counter()
+    for i in range(args.calls):
+        await cache.get(phone(i))
+    cold = (time.perf_counter() - t0) / args.calls * 1000
+
+    cache = PatientCache(provider)
+    cache.prefetch([phone(i) for i in range(args.calls)])
+    await asyncio.sleep(args.latency * 2)
+    t0 = time.perf_counter()
+    for i in range(args.calls):
+        await cache.get(phone(i))
+    warm = (time.perf_counter() - t0) / args.calls * 1000
+
+    cache = PatientCache(provider)
+    provider.fetches = 0
+    records = await asyncio.gather(*(cache.get(phone(i)) for i in range(args.concurrency)))
+    coalesced = provider.fetches
+    found = sum(r is not None for r in records)
+
+    print(f"lookup at call start {cold:10.3f} ms per call")
+    print(f"prefetched           {warm:10.3f} ms per call")
+    print(f"{args.concurrency} concurrent lookups: {coalesced} fetch, {found} found")
+    return coalesced == 1 and found == args.concurrency
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        path = os.path.join(scratch, "patients.db")
+        db = connect(path)
+        with db:
+            db.executemany(
+                "INSERT INTO patients VALUES (?, ?, ?, ?, ?)",
+                [
+                    (phone(i), f"Patient {i}", f"Office {i}", "knee replacement",
+                     json.dumps(["Knee X-ray"]))
+                    for i in range(max(args.calls, args.concurrency))
+                ],
+            )
+        db.close()
+        ok = asyncio.run(run(path, args))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
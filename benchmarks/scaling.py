@@ -0,0 +1,144 @@
+"""Checks that the router keeps conversations on their workers and measures
+how webhook throughput scales with the number of workers.
+
+For each worker count, starts the router (router.py) with that many uvicorn
+workers, runs the load test from benchmarks.load through it, then checks that
+every conversation completed without errors and that the workers' merged
+/metrics account for exactly the webhooks that were sent.
+
+    python -m benchmarks.scaling --workers 1 2 4 --conversations 1000
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+from benchmarks import fake_daily, load
+
+TRANSITION = re.compile(r'^call_tree_transitions_total\{.*worker="([^"]+)"\} (\d+)$', re.M)
+
+
+async def wait_for_workers(session, base_url, count, timeout=60):
+    """Waits until the router and all its workers answer /metrics."""
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(f"{base_url}/metrics") as r:
+                if r.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{count} workers didn't start")
+        await asyncio.sleep(0.2)
+
+
+async def transitions_by_worker(session, base_url):
+    async with session.get(f"{base_url}/metrics") as r:
+        text = await r.text()
+    counts = {}
+    for worker, value in TRANSITION.findall(text):
+        counts[worker] = counts.get(worker, 0) + int(value)
+    return counts
+
+
+async def run_workers(workers, args):
+    router = subprocess.Popen(
+        [
+            sys.executable, "-m", "router",
+            "--port", str(args.port),
+            "--workers", str(workers),
+            "--worker-port", str(args.worker_port),
+        ],
+        env={
+            **os.environ,
+            "BOT_START_URL": f"http://127.0.0.1:{args.daily_port}/bots/start",
+            "DAILY_API_KEY": "fake",
+            "LOG_LEVEL": "WARNING",
+            "DISPOSITIONS_DB": args.dispositions_db,
+        },
+        stdout=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_for_workers(session, base_url, workers)
+            load_args = load.build_parser().parse_args(
+                [
+                    "--url", base_url,
+                    "--conversations", str(args.conversations),
+                    "--concurrency", str(args.concurrency),
+                    "--daily-port", str(args.daily_port),
+                    "--seed", str(args.seed),
+                ]
+            )
+            results = await load.run(load_args, start_daily=False)
+            counts = await transitions_by_worker(session, base_url)
+    finally:
+        router.terminate()
+        router.wait()
+    return results, counts
+
+
+async def run(args):
+    daily = await fake_daily.serve(args.daily_port, latency=args.daily_latency)
+    rows = []
+    failed = False
+    try:
+        for workers in args.workers:
+            results, counts = await run_workers(workers, args)
+            summary = results.summary()
+            problems = list(results.errors[:5])
+            if sum(counts.values()) != summary["webhooks"]:
+                problems.append(
+                    f"workers made {sum(counts.values())} transitions for "
+                    f"{summary['webhooks']} webhooks"
+                )
+            if len(counts) != workers:
+                problems.append(f"only {len(counts)} of {workers} workers got calls")
+            failed = failed or bool(problems)
+            rows.append((workers, summary, counts, problems))
+    finally:
+        await daily.cleanup()
+    return rows, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--conversations", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8003)
+    parser.add_argument("--worker-port", type=int, default=8200)
+    parser.add_argument("--daily-port", type=int, default=8767)
+    parser.add_argument("--daily-latency", type=float, default=0.05)
+    parser.add_argument("--dispositions-db", default="scaling-dispositions.db")
+    args = parser.parse_args(argv)
+
+    rows, failed = asyncio.run(run(args))
+    base = rows[0][1]["webhooks_per_s"] or 1
+    print(f"cores available {os.cpu_count()}")
+    print("workers  webhooks/s  scaling  webhook p50 ms  p99 ms  errors")
+    for workers, s, counts, problems in rows:
+        print(
+            f"{workers:>7}  {s['webhooks_per_s']:10.1f}  "
+            f"{s['webhooks_per_s'] / base:6.2f}x  "
+            f"{s['webhook_p50_ms']:14.2f}  {s['webhook_p99_ms']:6.2f}  "
+            f"{s['errors']:>6}"
+        )
+        print(f"         transitions by worker: {dict(sorted(counts.items()))}")
+        for problem in problems:
+            print(f"  FAIL: {problem}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Measures the memory each stored conversation takes as a live CallTree and
+as a `to_bytes` snapshot, and how long snapshotting and rebuilding take.
+
+    python -m benchmarks.snapshot --conversations 10000
+"""
+
+import argparse
+import asyncio
+import gc
+import timeit
+import tracemalloc
+
+from call_tree import CallTree, get_call_tree
+from conversations import MemoryConversationStore
+
+PATIENT = (
+    "Alice Adams",
+    "Dr. Carlson's office",
+    "knee replacement",
+    ["Knee X-ray taken on October 8", "Lab tests performed on October 10"],
+)
+
+
+def bytes_per_conversation(count, fill):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = fill(count)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used / count
+
+
+def live_trees(count):
+    cls = get_call_tree()
+    return [cls(*PATIENT) for _ in range(count)]
+
+
+def snapshot_store(count):
+    cls = get_call_tree()
+    store = MemoryConversationStore(ttl=3600, max_size=count, hot_size=0)
+
+    async def fill():
+        for i in range(count):
+            await store.create(str(i), cls(*PATIENT))
+
+    asyncio.run(fill())
+    return store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=10000)
+    parser.add_argument("--number", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    ct = get_call_tree()(*PATIENT)
+    ct.send("confirmed_office")
+    snapshot = ct.to_bytes()
+    to_us = timeit.timeit(ct.to_bytes, number=args.number) / args.number * 1e6
+    from_us = (
+        timeit.timeit(lambda: CallTree.from_bytes(snapshot), number=args.number)
+        / args.number
+        * 1e6
+    )
+
+    live = bytes_per_conversation(args.conversations, live_trees)
+    stored = bytes_per_conversation(args.conversations, snapshot_store)
+    print(f"snapshot size        {len(snapshot):8d} bytes")
+    print(f"to_bytes             {to_us:8.1f} us")
+    print(f"from_bytes           {from_us:8.1f} us")
+    print(f"live CallTree        {live:8.0f} bytes per conversation")
+    print(f"snapshot in store    {stored:8.0f} bytes per conversation")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Compares building a node's SSE response from message dicts, as webhooks
+used to, with rendering the precompiled templates.
+
+    python -m benchmarks.sse_payloads
+"""
+
+import json
+import timeit
+
+from call_tree import DEFAULT_LANGUAGE, get_call_tree
+
+
+def dict_path(ct):
+    # Rebuild the message dicts and encode them, like the old on_enter hooks
+    # and response_streamer did on every webhook.
+    return b"".join(
+        f"event: {k}\ndata: {json.dumps(v)}\n\n".encode()
+        for m in ct.messages
+        for k, v in m.items()
+    )
+
+
+def template_path(ct):
+    return b"".join(ct.sse_events())
+
+
+def main(number=20000):
+    ct = get_call_tree()(
+        patient_name="Alice Adams",
+        office_name="Dr. Carlson's office",
+        surgery="knee replacement",
+        documents=[
+            "Knee X-ray taken on October 8",
+            "Lab tests performed on October 10",
+        ],
+    )
+    print(f"{'node':<8}{'bytes':>8}{'dicts us':>12}{'template us':>14}{'speedup':>10}")
+    for node, events in ct.node_events[DEFAULT_LANGUAGE].items():
+        ct._node_events = events
+        ct._escaped = None
+        assert dict_path(ct) == template_path(ct)
+        old = min(timeit.repeat(lambda: dict_path(ct), number=number, repeat=3))
+        new = min(timeit.repeat(lambda: template_path(ct), number=number, repeat=3))
+        print(
+            f"{node:<8}{len(template_path(ct)):>8}"
+            f"{old / number * 1e6:>12.2f}{new / number * 1e6:>14.2f}"
+            f"{old / new:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Measures how quickly a fresh server process can answer its first webhook.
+
+Reports the time to `import main`, and for a new uvicorn process the time
+until it serves its first request, first /start and first /webhook. Pass
+--max-import-ms or --max-first-webhook-ms to exit non-zero on regressions.
+
+    python -m benchmarks.startup --runs 5
+"""
+
+import argparse
+import asyncio
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+from benchmarks import fake_daily
+from benchmarks.load import start_server
+
+
+def import_time(runs):
+    """Returns the median wall time, in ms, of importing main in a new process."""
+
+    baseline, times = [], []
+    for _ in range(runs):
+        for code, results in (("pass", baseline), ("import main", times)):
+            t0 = time.perf_counter()
+            subprocess.run(
+                [sys.executable, "-c", code], check=True, stdout=subprocess.DEVNULL
+            )
+            results.append(time.perf_counter() - t0)
+    return (statistics.median(times) - statistics.median(baseline)) * 1000
+
+
+async def first_requests(port, daily_port):
+    """Starts a server and times its first /, /start and /webhook from spawn."""
+
+    server = start_server(port, daily_port)
+    t0 = time.perf_counter()
+    base_url = f"http://127.0.0.1:{port}"
+    timings = {}
+    try:
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    async with session.get(f"{base_url}/") as r:
+                        if r.status == 200:
+                            break
+                except aiohttp.ClientError:
+                    await asyncio.sleep(0.005)
+            timings["ready"] = time.perf_counter() - t0
+            async with session.post(f"{base_url}/start", json={"dialout": "+1"}) as r:
+                data = await r.json()
+            timings["first_start"] = time.perf_counter() - t0
+            conversation_id = data["room_url"].rsplit("/", 1)[1]
+            t1 = time.perf_counter()
+            async with session.post(
+                f"{base_url}/webhook",
+                json={
+                    "function_name": "confirmed_office",
+                    "tool_call_id": "1",
+                    "arguments": {},
+                },
+                headers={"conversation-id": conversation_id},
+            ) as r:
+                await r.read()
+            timings["first_webhook"] = time.perf_counter() - t0
+            timings["first_webhook_latency"] = time.perf_counter() - t1
+    finally:
+        server.terminate()
+        server.wait()
+    return {k: v * 1000 for k, v in timings.items()}
+
+
+async def run(args):
+    daily = await fake_daily.serve(args.daily_port, latency=0)
+    try:
+        runs = [await first_requests(args.port, args.daily_port) for _ in range(args.runs)]
+    finally:
+        await daily.cleanup()
+    return {k: statistics.median(r[k] for r in runs) for k in runs[0]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--daily-port", type=int, default=8766)
+    parser.add_argument("--max-import-ms", type=float)
+    parser.add_argument("--max-first-webhook-ms", type=float)
+    args = parser.parse_args(argv)
+
+    imported = import_time(args.runs)
+    timings = asyncio.run(run(args))
+    print(f"import main          {imported:8.1f} ms")
+    print(f"serving requests     {timings['ready']:8.1f} ms after spawn")
+    print(f"first /start done    {timings['first_start']:8.1f} ms after spawn")
+    print(f"first /webhook done  {timings['first_webhook']:8.1f} ms after spawn")
+    print(f"first /webhook       {timings['first_webhook_latency']:8.1f} ms")
+
+    failed = False
+    if args.max_import_ms and imported > args.max_import_ms:
+        print(f"FAIL: import took more than {args.max_import_ms} ms")
+        failed = True
+    if args.max_first_webhook_ms and timings["first_webhook"] > args.max_first_webhook_ms:
+        print(f"FAIL: first webhook took more than {args.max_first_webhook_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
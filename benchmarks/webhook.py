@@ -0,0 +1,179 @@
+"""Compares /webhook with the endpoint it replaced, which had FastAPI validate
+a Pydantic FunctionCallRequest and raised HTTPExceptions for calls it couldn't
+handle.
+
+Both endpoints are mounted on the server's app and called in-process over
+ASGI, without a network or HTTP client in between, for three kinds of call:
+a transition (each on a fresh conversation), an unknown conversation and an
+event the current node doesn't allow. Also times parsing a body on its own.
+
+    python -m benchmarks.webhook --number 5000
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Annotated
+
+from fastapi import Header, HTTPException
+from pydantic import BaseModel
+from statemachine.exceptions import TransitionNotAllowed
+
+import main as server
+from call_tree import get_call_tree
+from webhooks import FunctionCall
+
+BODY = {
+    "function_name": "confirmed_office",
+    "tool_call_id": "call_abc123",
+    "arguments": {"office": "Dr. Carlson's office"},
+}
+PATHS = ("/legacy/webhook", "/webhook")
+
+
+class FunctionCallRequest(BaseModel):
+    function_name: str
+    tool_call_id: str
+    arguments: dict
+
+
+async def legacy_webhook(
+    req: FunctionCallRequest, conversation_id: Annotated[str | None, Header()] = None
+):
+    """/webhook as it was, less the logging."""
+
+    async with server.webhook_locks.get(conversation_id):
+        events = server.responses.get(conversation_id, req.tool_call_id)
+        if events is not None:
+            return server.sse_response(events)
+        ct = await server.conversations.get(conversation_id)
+        if ct is None:
+            raise HTTPException(status_code=404, detail="Unknown conversation")
+        source = ct.current_state.id
+        try:
+            ct.send(req.function_name)
+        except TransitionNotAllowed as e:
+            # Used to fall through to a 500.
+            raise HTTPException(status_code=409, detail=str(e))
+        events = ct.sse_events()
+        await server.conversations.save(conversation_id, ct)
+        server.responses.put(conversation_id, req.tool_call_id, req.function_name, events)
+    target = ct.current_state
+    server.metrics.transitions.inc(source, target.id)
+    server.disposition_sink.record_transition(conversation_id, ct, source, req.function_name)
+    return server.sse_response(events)
+
+
+async def call(app, path, body, conversation_id):
+    """Sends one POST through the ASGI app and returns its status."""
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"conversation-id", conversation_id.encode()),
+        ],
+        "client": ("127.0.0.1", 1),
+        "server": ("127.0.0.1", 8000),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    status = None
+
+    async def receive():
+        return messages.pop() if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def time_calls(app, body, legacy_ids, fast_ids):
+    """Alternates calls to the two endpoints, so both see the same store and
+    heap, and returns the mean us per call of each."""
+
+    totals = [0.0, 0.0]
+    for ids in zip(legacy_ids, fast_ids):
+        for i, (path, conversation_id) in enumerate(zip(PATHS, ids)):
+            t0 = time.perf_counter()
+            await call(app, path, body, conversation_id)
+            totals[i] += time.perf_counter() - t0
+    return [t / len(legacy_ids) * 1e6 for t in totals]
+
+
+async def new_conversations(count):
+    tree = get_call_tree()
+    ids = []
+    for _ in range(count):
+        conversation_id = str(uuid.uuid4())
+        await server.conversations.create(
+            conversation_id,
+            tree("Alice Adams", "Dr. Carlson's office", "knee replacement", ["Knee X-ray"]),
+        )
+        ids.append(conversation_id)
+    return ids
+
+
+async def run(number):
+    app = server.app
+    app.post("/legacy/webhook")(legacy_webhook)
+    body = json.dumps(BODY).encode()
+    not_allowed = json.dumps({**BODY, "function_name": "expected_documents"}).encode()
+    unknown = [str(uuid.uuid4())] * number
+
+    known = await new_conversations(1)
+    for path in PATHS:
+        await call(app, path, not_allowed, known[0])
+
+    print(f"{'call':<22}{'legacy us':>12}{'fast path us':>14}")
+    rows = (
+        ("transition", body, None),
+        ("unknown conversation", body, unknown),
+        ("not allowed", not_allowed, known * number),
+    )
+    for name, payload, ids in rows:
+        if ids is None:
+            legacy, fast = await time_calls(
+                app, payload, await new_conversations(number), await new_conversations(number)
+            )
+        else:
+            legacy, fast = await time_calls(app, payload, ids, ids)
+        print(f"{name:<22}{legacy:>12.1f}{fast:>14.1f}")
+
+    t0 = time.perf_counter()
+    for _ in range(number):
+        FunctionCallRequest.model_validate_json(body)
+    t1 = time.perf_counter()
+    for _ in range(number):
+        FunctionCall.parse(body)
+    t2 = time.perf_counter()
+    print(
+        f"{'parse body':<22}{(t1 - t0) / number * 1e6:>12.1f}"
+        f"{(t2 - t1) / number * 1e6:>14.1f}"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args.number))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Builds the Daily Bots config that starts a bot on a call tree.
+
+Most of the config (the services, the initial prompt and tools) only depends
+on the call tree, so it's JSON-encoded once per tree and each /start splices
+its conversation id, patient and dial settings into the encoded bytes.
+"""
+
+import json
+import os
+import re
+
+from sse import escape_values
+
+# ${name} is part of a string, "${raw:name}" stands for a whole JSON value.
+SLOT = re.compile(r'"\$\{raw:(\w+)\}"|\$\{(\w+)\}')
+
+
+def bot_config(call_tree, max_duration):
+    """The bot config for a call tree class, with ${conversation_id}, the
+    patient's values and "${raw:run_on_config}" left as placeholders."""
+
+    webhook_host = os.getenv("WEBHOOK_HOST", "http://localhost:8000")
+    return {
+        "bot_profile": "voice_2024_10",
+        "max_duration": str(max_duration),
+        "services": {"tts": "cartesia", "llm": "openai"},
+        "api_keys": {"openai": os.getenv("OPENAI_API_KEY", None)},
+        "webhook_tools": {
+            "change_language": {
+                "url": f"{webhook_host}/language",
+                "method": "POST",
+                "streaming": True,
+                "custom_headers": {"conversation-id": "${conversation_id}"},
+            },
+            "*": {
+                "url": f"{webhook_host}/webhook",
+                "method": "POST",
+                "streaming": True,
+                "custom_headers": {"conversation-id": "${conversation_id}"},
+            },
+        },
+        "config": [
+            {
+                "service": "tts",
+                "options": [
+                    {
+                        "name": "voice",
+                        "value": "829ccd10-f8b3-43cd-b8a0-4aeaa81f3b30",
+                    }
+                ],
+            },
+            {
+                "service": "stt",
+                "options": [{"name": "model", "value": "nova-2-general"}],
+            },
+            {
+                "service": "llm",
+                "options": [
+                    {"name": "model", "value": "gpt-4o"},
+                    {
+                        "name": "initial_messages",
+                        "value": [
+                            {
+                                "role": "system",
+                                "content": [
+                                    {"type": "text", "text": call_tree.initial_prompt}
+                                ],
+                            }
+                        ],
+                    },
+                    {"name": "tools", "value": call_tree.initial_tools},
+                    {"name": "run_on_config", "value": "${raw:run_on_config}"},
+                ],
+            },
+        ],
+    }
+
+
+class BotConfigTemplate:
+    """A bot config encoded to JSON bytes once, with gaps for per-call values."""
+
+    __slots__ = ("_parts",)
+
+    def __init__(self, config):
+        parts = SLOT.split(json.dumps(config))
+        # Each literal is followed by a raw slot name and a string slot name,
+        # one of which is None, until the final literal.
+        self._parts = tuple(
+            p.encode() if i % 3 == 0 else p for i, p in enumerate(parts)
+        )
+
+    def render(self, values, raw, extra=None):
+        """Fills in JSON-escaped string `values` and `raw` JSON values, and
+        appends the `extra` top-level keys."""
+
+        parts = self._parts
+        out = [parts[0]]
+        for i in range(1, len(parts), 3):
+            if parts[i] is not None:
+                out.append(json.dumps(raw[parts[i]]).encode())
+            else:
+                out.append(values[parts[i + 1]])
+            out.append(parts[i + 2])
+        if extra:
+            out[-1] = out[-1][:-1]
+            out.append(b", " + json.dumps(extra)[1:-1].encode() + b"}")
+        return b"".join(out)
+
+
+_templates = {}
+
+
+def encode_bot_config(conversation_id, call_tree, max_duration, run_on_config, extra=None):
+    """The JSON-encoded bot config that starts a bot on `call_tree`."""
+
+    key = (type(call_tree), max_duration)
+    template = _templates.get(key)
+    if template is None:
+        template = _templates[key] = BotConfigTemplate(
+            bot_config(type(call_tree), max_duration)
+        )
+    values = escape_values({**call_tree.values, "conversation_id": conversation_id})
+    return template.render(values, {"run_on_config": run_on_config}, extra)
+
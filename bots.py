@@ -0,0 +1,107 @@
+import asyncio
+import os
+import random
+
+import aiohttp
+
+
+class BotStartError(Exception):
+    """Raised when Daily Bots refuses to start a bot session."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class BotLauncher:
+    """Starts Daily Bots sessions over one shared, app-lifetime connection pool.
+
+    Every launch reuses the same keep-alive connector, so the DNS lookup and
+    TLS handshake to the bots API are paid once instead of once per call. A
+    semaphore bounds how many launches are in flight at the same time.
+
+    Starting a bot isn't idempotent, so a launch is only retried (with
+    jittered exponential backoff) when the bots API can't have started a bot:
+    the connection couldn't be made, or the API answered 429 or 503. Timeouts
+    and other errors are raised, since the bot may already be dialing.
+    """
+
+    def __init__(
+        self,
+        start_url=None,
+        api_key=None,
+        max_connections=None,
+        concurrency=None,
+        retries=None,
+        backoff=None,
+    ):
+        self.start_url = start_url or os.getenv(
+            "BOT_START_URL", "https://api.daily.co/v1/bots/start"
+        )
+        self.api_key = api_key or os.getenv("DAILY_API_KEY")
+        self.max_connections = max_connections or int(
+            os.getenv("BOT_START_MAX_CONNECTIONS", "100")
+        )
+        self.concurrency = concurrency or int(os.getenv("BOT_START_CONCURRENCY", "20"))
+        self.retries = (
+            retries if retries is not None else int(os.getenv("BOT_START_RETRIES", "3"))
+        )
+        self.backoff = (
+            backoff
+            if backoff is not None
+            else float(os.getenv("BOT_START_BACKOFF", "0.5"))
+        )
+        self._session = None
+        self._semaphore = None
+
+    async def open(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections, keepalive_timeout=60, ttl_dns_cache=300
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            timeout=aiohttp.ClientTimeout(total=30),
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def start(self, bot_config, on_sending=None):
+        """Start one bot and return the response from the bots API.
+
+        `bot_config` is a dict, or the config already encoded as JSON bytes.
+        `on_sending` is called once the launch has its slot and is about to
+        be sent, after which cancelling it could leave a bot dialing.
+        """
+
+        async with self._semaphore:
+            if on_sending is not None:
+                on_sending()
+            attempt = 0
+            while True:
+                try:
+                    return await self._post(bot_config)
+                except (aiohttp.ClientConnectorError, BotStartError) as e:
+                    retryable = not isinstance(e, BotStartError) or e.status in (429, 503)
+                    if not retryable or attempt >= self.retries:
+                        raise
+                delay = self.backoff * (2**attempt)
+                await asyncio.sleep(delay + random.uniform(0, delay))
+                attempt += 1
+
+    async def _post(self, bot_config):
+        if isinstance(bot_config, bytes):
+            body = {"data": bot_config, "headers": {"Content-Type": "application/json"}}
+        else:
+            body = {"json": bot_config}
+        async with self._session.post(self.start_url, **body) as r:
+            if r.status != 200:
+                text = await r.text()
+                raise BotStartError(
+                    f"Problem starting a bot worker: {text}", status=r.status
+                )
+            return await r.json()
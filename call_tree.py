@@ -1,166 +1,234 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
 from statemachine import State, StateMachine
+from statemachine.factory import StateMachineMetaclass
+
+import context
+from actions import NodeAction
+from sse import SSEResponse, compile_messages, escape_values
+
+TREES_DIR = os.getenv(
+    "CALL_TREE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "trees")
+)
+DEFAULT_TREE = os.getenv("CALL_TREE", "records_request")
+# The language tree definitions are written in. Other languages override it.
+DEFAULT_LANGUAGE = "english"
+# "statemachine" runs call trees on python-statemachine, "table" on the flat
+# transition tables in engine.py.
+ENGINE = os.getenv("CALL_TREE_ENGINE", "statemachine")
+# Bumped whenever the fields in `CallTree.to_bytes` change.
+SNAPSHOT_VERSION = 3
+
+logger = logging.getLogger(__name__)
 
 
 class CallTree(StateMachine):
-    def __init__(self, patient_name, office_name, surgery, documents):
+    """Base class for the call trees that `load_call_tree` builds from definition
+    files in the trees directory."""
+
+    tree_name = None
+    # Compiled SSE templates sent on entering each node, by language.
+    node_events = {}
+    # Templates for the `compact_prompt` of nodes that have one, by language.
+    compact_prompts = {}
+    # The events (function names) that leave each node.
+    allowed_events = {}
+    # The (on_exit, on_enter) actions of the nodes that have any.
+    node_actions = {}
+    # The initial node's system prompt and tools, used to start the bot.
+    initial_prompt = ""
+    initial_tools = []
+
+    def __init__(
+        self,
+        patient_name,
+        office_name,
+        surgery,
+        documents,
+        state=None,
+        started_at=None,
+        language=DEFAULT_LANGUAGE,
+        history=(),
+        campaign=None,
+        llm_context=None,
+    ):
         self._patient_name = patient_name
         self._office_name = office_name
         self._surgery = surgery
         self._documents = documents
-        self.messages = []
-        super().__init__()
+        self.started_at = started_at or time.time()
+        self.language = language
+        # The nodes entered since the initial node, in order.
+        self.history = list(history)
+        # The campaign file this call was dialed from, if any.
+        self.campaign = campaign
+        # The estimated tokens of prompt sent to the bot so far, and the names
+        # of the tools it has. See context.py.
+        self.llm_context = llm_context or [
+            context.estimate_tokens(self.initial_prompt.encode()),
+            context.tool_names(self.initial_tools),
+        ]
+        self._escaped = None
+        self._node_events = ()
+        super().__init__(start_value=state)
+
+    def to_bytes(self):
+        """A compact snapshot of this call tree, for storing the conversation
+        without keeping the state machine alive.
+
+        Only the tree's name, the current node, the patient data and the path
+        taken are kept; the compiled tree is looked up again on `from_bytes`.
+        """
+
+        return json.dumps(
+            [
+                SNAPSHOT_VERSION,
+                self.tree_name,
+                self.current_state.id,
+                self.language,
+                self.started_at,
+                self._patient_name,
+                self._office_name,
+                self._surgery,
+                self._documents,
+                self.history,
+                self.campaign,
+                self.llm_context,
+            ],
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode()
+
+    @staticmethod
+    def from_bytes(data):
+        """Rebuilds a call tree from a `to_bytes` snapshot."""
+
+        fields = json.loads(data)
+        if fields[0] > SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version: {fields[0]}")
+        _, tree, state, language, started_at, *patient, history = fields[:10]
+        return get_call_tree(tree)(
+            *patient,
+            state=state,
+            started_at=started_at,
+            language=language,
+            history=history,
+            # Version 1 snapshots end at the history, version 2 at the campaign.
+            campaign=fields[10] if len(fields) > 10 else None,
+            llm_context=fields[11] if len(fields) > 11 else None,
+        )
+
+    @property
+    def values(self):
+        """The per-call values spliced into this tree's message templates."""
+
+        return {
+            "patient_name": self._patient_name,
+            "office_name": self._office_name,
+            "surgery": self._surgery,
+            "documents": "; ".join(self._documents),
+        }
+
+    @property
+    def messages(self):
+        """The RTVI messages for the current node, as dicts."""
 
-    def disposition(self, message):
-        print(f"!!! DISPOSITION: {message}")
+        values = self.values
+        return [e.message(values) for e in self._node_events]
 
-    node_1 = State(initial=True)
-    node_2 = State()
-    node_3 = State()
-    node_4 = State()
-    node_5 = State()
-    node_6 = State()
+    def sse_events(self):
+        """The RTVI messages for the current node, as server-sent events."""
 
-    wrong_number = node_1.to(node_2)
-    confirmed_office = node_1.to(node_3)
-    human_followup = node_3.to(node_4) | node_5.to(node_4)
-    correct_person = node_3.to(node_5)
-    expected_documents = node_5.to(node_6)
+        if self._escaped is None:
+            self._escaped = escape_values(self.values)
+        return SSEResponse(self._node_events, self._escaped)
+
+    def after_transition(self, target):
+        revisit = target.id in self.history
+        self.history.append(target.id)
+        self._node_events = self._context_delta(target.id, revisit)
+
+    def transition_actions(self, source, target):
+        """The actions to run on leaving node `source` (None when the
+        conversation starts) and entering node `target`."""
+
+        none = ((), ())
+        return self.node_actions.get(source, none)[0] + self.node_actions.get(target, none)[1]
+
+    def _context_delta(self, node_id, revisit):
+        """Narrows the events for a node just entered to what the bot doesn't
+        already have."""
+
+        if self._escaped is None:
+            self._escaped = escape_values(self.values)
+        compact = (
+            self.compact_prompts.get(self.language) or self.compact_prompts[DEFAULT_LANGUAGE]
+        ).get(node_id)
+        return context.delta(
+            node_id, self._node_events, compact, self._escaped, self.llm_context, revisit
+        )
 
     def on_exit_state(self, event, state):
-        self.messages = []
+        self._node_events = ()
 
-    def on_enter_node_1(self):
-        print("!!! Entering node 1")
+    def on_enter_state(self, state):
+        logger.debug("Entering %s", state.id)
+        events = self.node_events.get(self.language) or self.node_events[DEFAULT_LANGUAGE]
+        self._node_events = events.get(state.id, ())
 
-    def on_enter_node_2(self):
-        self.messages = [
-            {
-                "action": {
-                    "service": "tts",
-                    "action": "say",
-                    "arguments": [
-                        {
-                            "name": "text",
-                            "value": "Sorry for the trouble. Have a nice day!",
-                        },
-                        {"name": "save", "value": True},
-                        {"name": "interrupt", "value": False},
-                    ],
-                }
-            },
-        ]
-        print("WRONG NUMBER")
 
-    def on_enter_node_3(self):
-        self.messages = [
-            {
-                "action": {
-                    "service": "llm",
-                    "action": "append_to_messages",
-                    "arguments": [
-                        {
-                            "name": "messages",
-                            "value": [
-                                {
-                                    "role": "system",
-                                    "content": f"""Now that you've confirmed you're speaking to the right office, you need to collect the following medical records:
-                                    
-                                    {'; '.join(self._documents)}
-                                    
-                                    If the person you're speaking to can help provide the documents, call the correct_person function. If they say you need to speak to someone else, wait for them to transfer you, confirm the person you're speaking to can help, and then call the correct_person function. If they tell you they can't help, call the human_followup function.
-                                    """,
-                                }
-                            ],
-                        },
-                        {"name": "run_immediately", "value": False},
-                    ],
-                }
-            },
-            {
-                "action": {
-                    "service": "llm",
-                    "action": "set_context",
-                    "arguments": [
-                        {
-                            "name": "tools",
-                            "value": [
-                                {
-                                    "type": "function",
-                                    "function": {
-                                        "name": "correct_person",
-                                        "description": "Call this function when you've confirmed that you're speaking with someone who can provide the requested medical records.",
-                                        "parameters": {
-                                            "type": "object",
-                                            "properties": {
-                                                "office": {
-                                                    "type": "string",
-                                                    "description": "The name of the office you're calling.",
-                                                },
-                                            },
-                                            "required": ["office"],
-                                        },
-                                    },
-                                },
-                                {
-                                    "type": "function",
-                                    "function": {
-                                        "name": "human_followup",
-                                        "description": "Call this function if the user says they are unable to help with your request for medical records.",
-                                        "parameters": {
-                                            "type": "object",
-                                            "properties": {
-                                                "office": {
-                                                    "type": "string",
-                                                    "description": "The name of the office you're calling.",
-                                                },
-                                            },
-                                            "required": ["office"],
-                                        },
-                                    },
-                                },
-                            ],
-                        },
-                        {"name": "run_immediately", "value": False},
-                    ],
-                }
-            },
-            {
-                "action": {
-                    "service": "tts",
-                    "action": "say",
-                    "arguments": [
-                        {
-                            "name": "text",
-                            "value": f"I’m a digital assistant calling from Tri-County Medical Services regarding {self._patient_name}, who is scheduled for {self._surgery}. Our office needs some help with some of their medical records. Are you able to assist with that?",
-                        },
-                        {"name": "save", "value": True},
-                        {"name": "interrupt", "value": False},
-                    ],
-                }
+def tool_schema(name, tool):
+    """Expands a tool definition into an OpenAI function schema.
+
+    Parameters given as a plain description are required string parameters.
+    """
+
+    parameters = tool.get("parameters", {})
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": tool["description"],
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    k: v if isinstance(v, dict) else {"type": "string", "description": v}
+                    for k, v in parameters.items()
+                },
+                "required": list(parameters),
             },
-        ]
+        },
+    }
+
+
+def node_messages(node, tools):
+    """The RTVI messages sent to the bot on entering a node.
 
-    def on_enter_node_4(self):
-        self.messages = [
+    The spoken line comes first, so the bot can start talking while the
+    prompt and tools that follow are still being sent.
+    """
+
+    messages = []
+    if "say" in node:
+        messages.append(
             {
                 "action": {
                     "service": "tts",
                     "action": "say",
                     "arguments": [
-                        {
-                            "name": "text",
-                            "value": "I understand, thank you for checking. We will have someone from our team follow up with you shortly.",
-                        },
+                        {"name": "text", "value": node["say"]},
                         {"name": "save", "value": True},
                         {"name": "interrupt", "value": False},
                     ],
                 }
-            },
-        ]
-        print("CAN'T HELP")
-
-    def on_enter_node_5(self):
-        self.messages = [
+            }
+        )
+    if "prompt" in node:
+        messages.append(
             {
                 "action": {
                     "service": "llm",
@@ -168,94 +236,161 @@ class CallTree(StateMachine):
                     "arguments": [
                         {
                             "name": "messages",
-                            "value": [
-                                {
-                                    "role": "system",
-                                    "content": f"""TASK: 
-                                    Now that you've confirmed you're speaking to the right person to help, you need to collect the following medical records:
-                                    
-                                    {'; '.join(self._documents)}
-                                    
-                                    The user can provide the records by email or fax. They can email PDFs to documents@tricountymed.com, or they can fax them to 480-348-3345. You should try to get the documents today if you can, but you can wait up to a week if necessary.
-                                    
-                                    Ask the user how they'd like to send the records, and when they think they'll be able to send them. When you have a method and date, call the expected_documents function. If you're unable to complete the task, call the human_followup function.
-                                    """,
-                                }
-                            ],
+                            "value": [{"role": "system", "content": node["prompt"]}],
+                        },
+                        {
+                            "name": "run_immediately",
+                            "value": node.get("run_immediately", False),
                         },
-                        {"name": "run_immediately", "value": True},
                     ],
                 }
-            },
+            }
+        )
+    if "tools" in node:
+        messages.append(
             {
                 "action": {
                     "service": "llm",
                     "action": "set_context",
                     "arguments": [
-                        {
-                            "name": "tools",
-                            "value": [
-                                {
-                                    "type": "function",
-                                    "function": {
-                                        "name": "expected_documents",
-                                        "description": "Call this function when you've verified that the user has all the documents you need, and they've told you how and when they are able to send them to you.",
-                                        "parameters": {
-                                            "type": "object",
-                                            "properties": {
-                                                "method": {
-                                                    "type": "string",
-                                                    "description": "How the user plans to send you the documents, such as 'email' or 'fax'.",
-                                                },
-                                                "date": {
-                                                    "type": "string",
-                                                    "description": "The expected date you will receive the documents in YYYY-MM-DD format.",
-                                                },
-                                            },
-                                            "required": ["method", "date"],
-                                        },
-                                    },
-                                },
-                                {
-                                    "type": "function",
-                                    "function": {
-                                        "name": "human_followup",
-                                        "description": "Call this function if the user says they are unable to help with your request for medical records.",
-                                        "parameters": {
-                                            "type": "object",
-                                            "properties": {
-                                                "office": {
-                                                    "type": "string",
-                                                    "description": "The name of the office you're calling.",
-                                                },
-                                            },
-                                            "required": ["office"],
-                                        },
-                                    },
-                                },
-                            ],
-                        },
+                        {"name": "tools", "value": [tools[t] for t in node["tools"]]},
                         {"name": "run_immediately", "value": False},
                     ],
                 }
-            },
-        ]
+            }
+        )
+    return messages
 
-    def on_enter_node_6(self):
-        self.messages = [
-            {
-                "action": {
-                    "service": "tts",
-                    "action": "say",
-                    "arguments": [
-                        {
-                            "name": "text",
-                            "value": "It looks like I have everything I need. Thanks for your help! Goodbye!",
-                        },
-                        {"name": "save", "value": True},
-                        {"name": "interrupt", "value": False},
-                    ],
-                }
-            },
-        ]
-        print("CAN'T HELP")
+
+def localize(node, localized, node_id):
+    """Applies a language's overrides and instructions to a node definition."""
+
+    node = {**node, **localized.get("nodes", {}).get(node_id, {})}
+    for key in ("prompt", "compact_prompt"):
+        if key in node and localized.get("instructions"):
+            node[key] = f"{node[key]}\n{localized['instructions']}"
+    return node
+
+
+def compact_node(node):
+    """A node that only sends its `compact_prompt`, in place of its prompt."""
+
+    return {
+        "prompt": node["compact_prompt"],
+        "run_immediately": node.get("run_immediately", False),
+    }
+
+
+def build_call_tree(name, definition):
+    """Builds a CallTree subclass from a parsed tree definition."""
+
+    tools = {n: tool_schema(n, t) for n, t in definition.get("tools", {}).items()}
+    nodes = definition["nodes"]
+    states = {
+        node_id: State(initial=bool(node.get("initial")), final=bool(node.get("final")))
+        for node_id, node in nodes.items()
+    }
+    transitions = {}
+    for node_id, node in nodes.items():
+        for event, target in node.get("transitions", {}).items():
+            t = states[node_id].to(states[target])
+            transitions[event] = transitions[event] | t if event in transitions else t
+
+    initial = next(n for n, node in nodes.items() if node.get("initial"))
+    languages = {DEFAULT_LANGUAGE: {}, **definition.get("languages", {})}
+    node_events = {
+        language: {
+            node_id: compile_messages(
+                node_messages(localize(node, localized, node_id), tools)
+            )
+            for node_id, node in nodes.items()
+            if node_id != initial
+        }
+        for language, localized in languages.items()
+    }
+    compact_prompts = {
+        language: {
+            node_id: compile_messages(
+                node_messages(compact_node(localize(node, localized, node_id)), tools)
+            )[0]
+            for node_id, node in nodes.items()
+            if "compact_prompt" in node and node_id != initial
+        }
+        for language, localized in languages.items()
+    }
+    attrs = {
+        **states,
+        **transitions,
+        "tree_name": name,
+        "node_events": node_events,
+        "compact_prompts": compact_prompts,
+        "allowed_events": {
+            node_id: frozenset(node.get("transitions", {})) for node_id, node in nodes.items()
+        },
+        "node_actions": {
+            node_id: tuple(
+                tuple(NodeAction.from_definition(a) for a in node.get(key, ()))
+                for key in ("on_exit", "on_enter")
+            )
+            for node_id, node in nodes.items()
+            if "on_exit" in node or "on_enter" in node
+        },
+        "initial_prompt": nodes[initial].get("prompt", ""),
+        "initial_tools": [tools[t] for t in nodes[initial].get("tools", [])],
+    }
+    class_name = "".join(p.title() for p in name.split("_")) + "CallTree"
+    return StateMachineMetaclass(class_name, (CallTree,), attrs)
+
+
+def parse_definition(path, data):
+    if path.endswith(".json"):
+        return json.loads(data)
+    import yaml
+
+    return yaml.safe_load(data)
+
+
+# Compiled tree classes, keyed by tree name and file hash, and the last hash
+# seen for each file so unchanged files aren't re-read.
+_trees = {}
+_tree_files = {}
+
+
+def load_call_tree(path):
+    """Returns the CallTree class for a definition file.
+
+    Each version of a file is only compiled once, so looking a tree up on every
+    /start is cheap and edited files are picked up without a restart.
+    """
+
+    mtime = os.stat(path).st_mtime_ns
+    cached = _tree_files.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, "rb") as f:
+        data = f.read()
+    name = os.path.splitext(os.path.basename(path))[0]
+    key = (name, hashlib.sha256(data).hexdigest())
+    cls = _trees.get(key)
+    if cls is None:
+        cls = build_call_tree(name, parse_definition(path, data))
+        if ENGINE == "table":
+            from engine import compile_tree
+
+            cls = compile_tree(cls)
+        _trees[key] = cls
+    _tree_files[path] = (mtime, cls)
+    return cls
+
+
+def get_call_tree(name=None):
+    """Returns the CallTree class for a named tree in TREES_DIR."""
+
+    name = name or DEFAULT_TREE
+    if not name.replace("_", "").replace("-", "").isalnum():
+        raise ValueError(f"Invalid call tree name: {name}")
+    for ext in (".yaml", ".yml", ".json"):
+        path = os.path.join(TREES_DIR, name + ext)
+        if os.path.exists(path):
+            return load_call_tree(path)
+    raise ValueError(f"Unknown call tree: {name}")
@@ -0,0 +1,301 @@
+"""Runs outbound calling campaigns from a CSV or JSONL file of patients.
+
+Each row needs a `phone`, and `patient_name`, `office_name`, `surgery` and
+`documents` unless the patient is looked up by phone number (see
+patients.py). In CSV files, separate multiple documents with semicolons. Rows
+can also set `id`, `tree`, `timezone` (such as "America/New_York") and
+`window` (such as "09:00-17:00") for the office's calling hours.
+"""
+
+import asyncio
+import csv
+import fcntl
+import heapq
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+
+def load_calls(path):
+    """Reads a campaign file into a list of call dicts."""
+
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    calls = []
+    for row in rows:
+        documents = row.get("documents") or []
+        if isinstance(documents, str):
+            documents = [d.strip() for d in documents.split(";") if d.strip()]
+        calls.append(
+            {
+                "id": row.get("id") or f"{row['phone']}:{row.get('patient_name') or ''}",
+                "patient_name": row.get("patient_name") or None,
+                "office_name": row.get("office_name") or None,
+                "surgery": row.get("surgery") or None,
+                "documents": documents,
+                "phone": row["phone"],
+                "tree": row.get("tree") or None,
+                "timezone": row.get("timezone")
+                or os.getenv("CAMPAIGN_TIMEZONE", "America/Chicago"),
+                "window": row.get("window") or os.getenv("CAMPAIGN_WINDOW", "09:00-17:00"),
+            }
+        )
+    return calls
+
+
+def next_open(call, at):
+    """Returns the first time at or after `at` that the office is open for calls."""
+
+    tz = pytz.timezone(call["timezone"])
+    start, end = (
+        datetime.strptime(t.strip(), "%H:%M").time() for t in call["window"].split("-")
+    )
+    local = datetime.fromtimestamp(at, tz)
+    if start <= local.time() < end:
+        return at
+    day = local.date() if local.time() < start else local.date() + timedelta(days=1)
+    return tz.localize(datetime.combine(day, start)).timestamp()
+
+
+class RateLimiter:
+    """Spaces out `acquire` calls so at most `rate` succeed per second."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next = 0.0
+
+    async def acquire(self):
+        now = time.monotonic()
+        wait = self._next - now
+        self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class CampaignRunning(Exception):
+    """Raised when a campaign file is already being dialed."""
+
+
+class Campaign:
+    """Dials every call in a campaign file through `launch`, within each
+    office's calling window, at most `calls_per_second` new calls per second
+    and at most `max_concurrent` bots at once.
+
+    `launch(call)` starts a bot and returns its conversation id.
+    `status(conversation_id)` returns the conversation's current node, or
+    None once it has ended. If given, `prefetch(phones)` is called with the
+    numbers of the next `prefetch_ahead` calls without a patient, so their
+    patients are looked up before they're dialed. A bot holds its slot until its conversation
+    reaches a final node, ends, or runs past `max_duration`. Calls that never
+    get past the first node (busy, no answer) or that fail to start are
+    retried after `retry_delay` seconds, up to `max_attempts` times.
+
+    Every attempt and outcome is appended to a checkpoint file, so running
+    the same campaign again after a restart picks up where it left off.
+    `claim` takes a lock next to the checkpoint first, so the same file is
+    never dialed by two campaigns at once, in this process or another.
+    """
+
+    def __init__(
+        self,
+        path,
+        launch,
+        status,
+        max_duration,
+        checkpoint_path=None,
+        calls_per_second=None,
+        max_concurrent=None,
+        max_attempts=None,
+        retry_delay=None,
+        poll_interval=5,
+        prefetch=None,
+        prefetch_ahead=None,
+    ):
+        self.path = path
+        self.launch = launch
+        self.status = status
+        self.max_duration = max_duration
+        self.checkpoint_path = checkpoint_path or f"{path}.progress.jsonl"
+        self.rate = RateLimiter(
+            calls_per_second or float(os.getenv("CAMPAIGN_CALLS_PER_SECOND", "1"))
+        )
+        self.max_concurrent = max_concurrent or int(
+            os.getenv("CAMPAIGN_MAX_CONCURRENT", "10")
+        )
+        self.max_attempts = max_attempts or int(os.getenv("CAMPAIGN_MAX_ATTEMPTS", "3"))
+        self.retry_delay = (
+            retry_delay
+            if retry_delay is not None
+            else float(os.getenv("CAMPAIGN_RETRY_DELAY", "900"))
+        )
+        self.poll_interval = poll_interval
+        self.prefetch = prefetch
+        self.prefetch_ahead = prefetch_ahead or int(
+            os.getenv("CAMPAIGN_PREFETCH_AHEAD", "50")
+        )
+        self.attempts = {}
+        self.outcomes = {}
+        self.active = 0
+        self.total = 0
+        self._queue = []
+        self._wakeup = asyncio.Event()
+        self._lock_file = None
+
+    def progress(self):
+        counts = {}
+        for outcome in self.outcomes.values():
+            counts[outcome] = counts.get(outcome, 0) + 1
+        return {
+            "path": self.path,
+            "total": self.total,
+            "done": len(self.outcomes),
+            "active": self.active,
+            "queued": len(self._queue),
+            "outcomes": counts,
+        }
+
+    def claim(self):
+        """Locks the campaign file for this campaign until `run` finishes or
+        `release` is called, raising CampaignRunning if another campaign
+        holds it."""
+
+        f = open(f"{self.checkpoint_path}.lock", "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            raise CampaignRunning(self.path) from None
+        self._lock_file = f
+
+    async def run(self):
+        if self._lock_file is None:
+            self.claim()
+        try:
+            await self._run()
+        finally:
+            self.release()
+
+    def release(self):
+        """Unlocks the campaign file, if this campaign holds it."""
+
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    async def _run(self):
+        calls = load_calls(self.path)
+        self.total = len(calls)
+        self._restore()
+        for i, call in enumerate(calls):
+            if call["id"] not in self.outcomes:
+                heapq.heappush(self._queue, (0, i, call))
+
+        slots = asyncio.Semaphore(self.max_concurrent)
+        tasks = set()
+        while self._queue or tasks:
+            if not self._queue:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            not_before, i, call = self._queue[0]
+            now = time.time()
+            at = next_open(call, max(now, not_before))
+            if at > now:
+                heapq.heapreplace(self._queue, (at, i, call))
+                # Another call may now be first and ready before this one is.
+                delay = self._queue[0][0] - now
+                if delay > 0:
+                    await self._wait(delay)
+                continue
+            heapq.heappop(self._queue)
+            if self.prefetch:
+                upcoming = heapq.nsmallest(self.prefetch_ahead, self._queue)
+                self.prefetch(
+                    [c["phone"] for _, _, c in [(at, i, call), *upcoming] if not c["patient_name"]]
+                )
+            await slots.acquire()
+            await self.rate.acquire()
+            task = asyncio.create_task(self._dial(i, call, slots))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        logger.info("Campaign finished", extra={"fields": self.progress()})
+
+    async def _wait(self, timeout):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _dial(self, i, call, slots):
+        self.active += 1
+        attempt = self.attempts.get(call["id"], 0) + 1
+        self.attempts[call["id"]] = attempt
+        try:
+            try:
+                conversation_id = await self.launch(call)
+            except Exception as e:
+                logger.warning("Campaign call %s failed to start: %s", call["id"], e)
+                conversation_id, outcome = None, "start_failed"
+            else:
+                self._checkpoint(call["id"], attempt, "dialing", conversation_id)
+                outcome = await self._watch(conversation_id)
+        finally:
+            self.active -= 1
+            slots.release()
+
+        if outcome in ("start_failed", "no_answer") and attempt < self.max_attempts:
+            self._checkpoint(call["id"], attempt, outcome, conversation_id)
+            heapq.heappush(self._queue, (time.time() + self.retry_delay, i, call))
+        else:
+            self.outcomes[call["id"]] = outcome
+            self._checkpoint(call["id"], attempt, outcome, conversation_id, done=True)
+        self._wakeup.set()
+
+    async def _watch(self, conversation_id):
+        """Waits for a conversation to finish and returns its outcome."""
+
+        deadline = time.monotonic() + self.max_duration
+        last = None
+        while time.monotonic() < deadline:
+            state = await self.status(conversation_id)
+            if state is None:
+                break
+            last = state
+            if state.final:
+                return state.id
+            await asyncio.sleep(self.poll_interval)
+        if last is None or last.initial:
+            return "no_answer"
+        return "abandoned"
+
+    def _restore(self):
+        if not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path) as f:
+            for line in f:
+                entry = json.loads(line)
+                self.attempts[entry["id"]] = entry["attempt"]
+                if entry.get("done"):
+                    self.outcomes[entry["id"]] = entry["outcome"]
+
+    def _checkpoint(self, call_id, attempt, outcome, conversation_id, done=False):
+        entry = {
+            "id": call_id,
+            "attempt": attempt,
+            "outcome": outcome,
+            "conversation_id": conversation_id,
+            "ts": time.time(),
+        }
+        if done:
+            entry["done"] = True
+        with open(self.checkpoint_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
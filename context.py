@@ -0,0 +1,65 @@
+"""Keeps track of what each conversation's bot already has in its LLM context,
+so entering a node only sends what's new.
+
+The bot keeps every system prompt it's sent and replaces its tools with each
+set_context. So on entering a node:
+
+- set_context is left out if the node's tools are the ones the bot has;
+- the node's prompt is left out if the bot was already sent it, on an
+  earlier visit to the node;
+- if the prompt would take the conversation's prompts past
+  CONTEXT_TOKEN_BUDGET tokens and the node has a `compact_prompt`, that's
+  sent instead.
+
+Token counts are estimates, at about four bytes of encoded message per token.
+"""
+
+import os
+
+import metrics
+
+TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1000"))
+BYTES_PER_TOKEN = 4
+
+
+def estimate_tokens(data):
+    return len(data) // BYTES_PER_TOKEN
+
+
+def action(template):
+    return template.data.get("action") if template.event == "action" else None
+
+
+def tool_names(tools):
+    return [t["function"]["name"] for t in tools]
+
+
+def delta(node_id, templates, compact_prompt, escaped, context, revisit, budget=TOKEN_BUDGET):
+    """Picks which of a node's event templates to send.
+
+    `context` is the conversation's [prompt tokens, tool names] and is updated
+    with what gets sent. `revisit` says the bot has had this node's prompt.
+    """
+
+    events = []
+    for template in templates:
+        kind = action(template)
+        if kind == "set_context":
+            names = tool_names(template.data["arguments"][0]["value"])
+            if names == context[1]:
+                metrics.context_skipped.inc("tools")
+                continue
+            context[1] = names
+        elif kind == "append_to_messages":
+            if revisit:
+                metrics.context_skipped.inc("prompt")
+                continue
+            tokens = estimate_tokens(template.render(escaped))
+            if compact_prompt is not None and context[0] + tokens > budget:
+                metrics.context_skipped.inc("compacted")
+                template = compact_prompt
+                tokens = estimate_tokens(template.render(escaped))
+            context[0] += tokens
+            metrics.prompt_tokens.observe(tokens, node_id)
+        events.append(template)
+    return tuple(events)
@@ -0,0 +1,189 @@
+import os
+import time
+from collections import OrderedDict
+
+from call_tree import CallTree
+
+
+class ConversationStore:
+    """Holds the CallTree for every active conversation, keyed by conversation id.
+
+    `create` is called once from /start, before the bot is started, and
+    `touch` once the bot has started. Then every /webhook does a `get`, sends
+    the function call to the tree and `save`s it back; `save` never brings
+    back a conversation that was forgotten in between. Backends must forget
+    conversations on their own `ttl` seconds after they were last created or
+    touched, which should be at least the bot's max_duration.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    async def create(self, conversation_id, call_tree):
+        raise NotImplementedError
+
+    async def get(self, conversation_id):
+        raise NotImplementedError
+
+    async def save(self, conversation_id, call_tree):
+        raise NotImplementedError
+
+    async def touch(self, conversation_id, call_tree):
+        """Restarts a conversation's `ttl`, storing `call_tree` again if the
+        conversation has already been forgotten."""
+
+        raise NotImplementedError
+
+    async def delete(self, conversation_id):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryConversationStore(ConversationStore):
+    """Keeps conversations in this process, bounded by LRU size and TTL.
+
+    Each conversation is held as a `CallTree.to_bytes` snapshot of about a
+    hundred bytes. Only the `hot_size` most recently used conversations also
+    keep their live CallTree; the rest are rebuilt from their snapshot on
+    their next webhook.
+
+    Conversations stay pinned to the worker that created them, so behind
+    more than one worker this needs the router (router.py).
+    """
+
+    def __init__(self, ttl, max_size=100000, hot_size=1000):
+        super().__init__(ttl)
+        self.max_size = max_size
+        self.hot_size = hot_size
+        self._entries = OrderedDict()
+        self._live = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def create(self, conversation_id, call_tree):
+        self._evict_expired()
+        self._entries[conversation_id] = (
+            time.monotonic() + self.ttl,
+            call_tree.to_bytes(),
+        )
+        self._keep_live(conversation_id, call_tree)
+        while len(self._entries) > self.max_size:
+            evicted, _ = self._entries.popitem(last=False)
+            self._live.pop(evicted, None)
+
+    async def get(self, conversation_id):
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return None
+        expires_at, snapshot = entry
+        if expires_at < time.monotonic():
+            await self.delete(conversation_id)
+            return None
+        self._entries.move_to_end(conversation_id)
+        call_tree = self._live.get(conversation_id)
+        if call_tree is None:
+            call_tree = CallTree.from_bytes(snapshot)
+        self._keep_live(conversation_id, call_tree)
+        return call_tree
+
+    async def save(self, conversation_id, call_tree):
+        entry = self._entries.get(conversation_id)
+        if entry is not None:
+            self._entries[conversation_id] = (entry[0], call_tree.to_bytes())
+
+    async def touch(self, conversation_id, call_tree):
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            await self.create(conversation_id, call_tree)
+            return
+        self._entries[conversation_id] = (time.monotonic() + self.ttl, entry[1])
+        self._entries.move_to_end(conversation_id)
+
+    async def delete(self, conversation_id):
+        self._entries.pop(conversation_id, None)
+        self._live.pop(conversation_id, None)
+
+    def _keep_live(self, conversation_id, call_tree):
+        self._live[conversation_id] = call_tree
+        self._live.move_to_end(conversation_id)
+        while len(self._live) > self.hot_size:
+            self._live.popitem(last=False)
+
+    def _evict_expired(self):
+        # Creation order means the oldest entries are at the front until they
+        # are touched, so stop at the first entry that hasn't expired yet.
+        now = time.monotonic()
+        while self._entries:
+            conversation_id, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at >= now:
+                break
+            del self._entries[conversation_id]
+            self._live.pop(conversation_id, None)
+
+
+class RedisConversationStore(ConversationStore):
+    """Stores each CallTree's `to_bytes` snapshot in Redis, so any worker or
+    node can handle any conversation's webhooks.
+
+    Pass an existing asyncio client (for example a `fakeredis.aioredis.FakeRedis`)
+    or a redis:// URL.
+    """
+
+    def __init__(self, ttl, client=None, url=None, prefix="conversation:"):
+        super().__init__(ttl)
+        if client is None:
+            import redis.asyncio
+
+            client = redis.asyncio.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    async def create(self, conversation_id, call_tree):
+        await self.client.set(
+            self.prefix + conversation_id, call_tree.to_bytes(), ex=self.ttl
+        )
+
+    async def get(self, conversation_id):
+        data = await self.client.get(self.prefix + conversation_id)
+        if data is None:
+            return None
+        return CallTree.from_bytes(data)
+
+    async def save(self, conversation_id, call_tree):
+        # Only overwrite a key that's still there: one that expired or was
+        # deleted since the `get` would come back without a TTL.
+        await self.client.set(
+            self.prefix + conversation_id, call_tree.to_bytes(), keepttl=True, xx=True
+        )
+
+    async def touch(self, conversation_id, call_tree):
+        if not await self.client.expire(self.prefix + conversation_id, self.ttl):
+            await self.client.set(
+                self.prefix + conversation_id, call_tree.to_bytes(), ex=self.ttl, nx=True
+            )
+
+    async def delete(self, conversation_id):
+        await self.client.delete(self.prefix + conversation_id)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def store_from_env(ttl):
+    """Builds the store selected by CONVERSATION_STORE ("memory" or "redis")."""
+
+    backend = os.getenv("CONVERSATION_STORE", "memory")
+    if backend == "memory":
+        return MemoryConversationStore(
+            ttl,
+            max_size=int(os.getenv("CONVERSATION_STORE_MAX_SIZE", "100000")),
+            hot_size=int(os.getenv("CONVERSATION_STORE_HOT_SIZE", "1000")),
+        )
+    if backend == "redis":
+        return RedisConversationStore(
+            ttl, url=os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        )
+    raise ValueError(f"Unknown CONVERSATION_STORE: {backend}")
@@ -0,0 +1,226 @@
+"""Records the outcome of each conversation, and every transition it made on
+the way, to SQLite.
+
+Query recorded outcomes with:
+
+    python -m dispositions --node node_6 --limit 20
+"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dispositions (
+    conversation_id TEXT NOT NULL,
+    tree TEXT,
+    node TEXT NOT NULL,
+    event TEXT,
+    arguments TEXT,
+    patient_name TEXT,
+    office_name TEXT,
+    started_at REAL,
+    ended_at REAL NOT NULL,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS dispositions_node ON dispositions (node, ended_at);
+CREATE TABLE IF NOT EXISTS transitions (
+    conversation_id TEXT NOT NULL,
+    tree TEXT,
+    campaign TEXT,
+    office_name TEXT,
+    source TEXT,
+    target TEXT NOT NULL,
+    event TEXT,
+    final INTEGER NOT NULL,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transitions_conversation
+    ON transitions (conversation_id, at);
+"""
+
+COLUMNS = (
+    "conversation_id",
+    "tree",
+    "node",
+    "event",
+    "arguments",
+    "patient_name",
+    "office_name",
+    "started_at",
+    "ended_at",
+    "duration",
+)
+
+TRANSITION_COLUMNS = (
+    "conversation_id",
+    "tree",
+    "campaign",
+    "office_name",
+    "source",
+    "target",
+    "event",
+    "final",
+    "at",
+)
+
+INSERTS = {
+    "dispositions": f"INSERT INTO dispositions VALUES ({', '.join('?' * len(COLUMNS))})",
+    "transitions": f"INSERT INTO transitions VALUES ({', '.join('?' * len(TRANSITION_COLUMNS))})",
+}
+
+
+def connect(path):
+    db = sqlite3.connect(path, timeout=30)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+class DispositionSink:
+    """Queues disposition and transition records and writes them to SQLite from
+    a background thread, committing everything that queued up since the last
+    write in one transaction.
+
+    `record` never blocks: if the writer falls more than `max_queue` records
+    behind, new records are dropped and logged.
+    """
+
+    def __init__(self, path=None, batch_size=500, flush_interval=0.5, max_queue=100000):
+        self.path = path or os.getenv("DISPOSITIONS_DB", "dispositions.db")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self.dropped = 0
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="disposition-writer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def record(self, conversation_id, call_tree, event, arguments):
+        """Records that a conversation's call tree reached a final node."""
+
+        now = time.time()
+        values = call_tree.values
+        row = (
+            conversation_id,
+            call_tree.tree_name,
+            call_tree.current_state.id,
+            event,
+            json.dumps(arguments),
+            values["patient_name"],
+            values["office_name"],
+            call_tree.started_at,
+            now,
+            now - call_tree.started_at if call_tree.started_at else None,
+        )
+        self._put("dispositions", row)
+
+    def record_transition(self, conversation_id, call_tree, source, event):
+        """Records that a conversation's call tree moved from `source` to its
+        current node. A `source` of None records the conversation starting."""
+
+        target = call_tree.current_state
+        row = (
+            conversation_id,
+            call_tree.tree_name,
+            call_tree.campaign,
+            call_tree.values["office_name"],
+            source,
+            target.id,
+            event,
+            int(target.final),
+            time.time(),
+        )
+        self._put("transitions", row)
+
+    def _put(self, table, row):
+        try:
+            self._queue.put_nowait((table, row))
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("Record queue full, dropped %s %s", table, row[:4])
+
+    def _run(self):
+        db = connect(self.path)
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopping = True
+                batch = [row for row in batch if row is not None]
+            if not batch:
+                continue
+            rows = {}
+            for table, row in batch:
+                rows.setdefault(table, []).append(row)
+            try:
+                with db:
+                    for table, table_rows in rows.items():
+                        db.executemany(INSERTS[table], table_rows)
+            except sqlite3.Error:
+                logger.exception("Failed to write %d records", len(batch))
+        db.close()
+
+
+def query(path=None, node=None, since=None, limit=100):
+    """Returns recorded dispositions, newest first, as dicts."""
+
+    db = connect(path or os.getenv("DISPOSITIONS_DB", "dispositions.db"))
+    where, params = [], []
+    if node:
+        where.append("node = ?")
+        params.append(node)
+    if since:
+        where.append("ended_at >= ?")
+        params.append(since)
+    sql = f"SELECT {', '.join(COLUMNS)} FROM dispositions"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY ended_at DESC LIMIT ?"
+    rows = db.execute(sql, params + [limit]).fetchall()
+    db.close()
+    results = []
+    for row in rows:
+        result = dict(zip(COLUMNS, row))
+        result["arguments"] = json.loads(result["arguments"] or "null")
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print recorded dispositions.")
+    parser.add_argument("--db", help="defaults to DISPOSITIONS_DB or dispositions.db")
+    parser.add_argument("--node", help="only show conversations that ended here")
+    parser.add_argument(
+        "--since", type=float, help="only show conversations that ended after this unix time"
+    )
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+    for result in query(args.db, args.node, args.since, args.limit):
+        print(json.dumps(result))
@@ -0,0 +1,139 @@
+"""A table-driven alternative to running call trees on python-statemachine.
+
+A call tree's transitions are a fixed (node, event) -> node table, and
+entering a node only swaps in its precompiled SSE templates. `compile_tree`
+flattens a CallTree class into that table, and the class it returns behaves
+like the CallTree (same attributes, snapshots, errors and events) without
+building python-statemachine's callback machinery for every conversation.
+
+Set CALL_TREE_ENGINE=table to use it.
+"""
+
+import logging
+import time
+
+from statemachine.event import Event
+from statemachine.exceptions import InvalidStateValue, TransitionNotAllowed
+
+import context
+from call_tree import DEFAULT_LANGUAGE, CallTree
+
+logger = logging.getLogger("call_tree")
+
+
+class TableCallTree:
+    """Base class for the call trees `compile_tree` builds."""
+
+    __slots__ = (
+        "_patient_name",
+        "_office_name",
+        "_surgery",
+        "_documents",
+        "started_at",
+        "language",
+        "history",
+        "campaign",
+        "llm_context",
+        "current_state",
+        "_escaped",
+        "_node_events",
+        "__weakref__",
+    )
+
+    # The python-statemachine class this table was compiled from.
+    definition = None
+    tree_name = None
+    node_events = {}
+    compact_prompts = {}
+    allowed_events = {}
+    node_actions = {}
+    initial_prompt = ""
+    initial_tools = []
+    states = ()
+    states_map = {}
+    initial_state_id = None
+    # (node id, event) -> target State.
+    table = {}
+
+    def __init__(
+        self,
+        patient_name,
+        office_name,
+        surgery,
+        documents,
+        state=None,
+        started_at=None,
+        language=DEFAULT_LANGUAGE,
+        history=(),
+        campaign=None,
+        llm_context=None,
+    ):
+        self._patient_name = patient_name
+        self._office_name = office_name
+        self._surgery = surgery
+        self._documents = documents
+        self.started_at = started_at or time.time()
+        self.language = language
+        self.history = list(history)
+        self.campaign = campaign
+        self.llm_context = llm_context or [
+            context.estimate_tokens(self.initial_prompt.encode()),
+            context.tool_names(self.initial_tools),
+        ]
+        self._escaped = None
+        if state is None:
+            state = self.initial_state_id
+        current = self.states_map.get(state)
+        if current is None:
+            raise InvalidStateValue(state)
+        self._enter(current)
+
+    def send(self, event):
+        target = self.table.get((self.current_state.id, event))
+        if target is None:
+            raise TransitionNotAllowed(Event(id=event, name=event), self.current_state)
+        revisit = target.id in self.history
+        self.history.append(target.id)
+        self._enter(target)
+        self._node_events = self._context_delta(target.id, revisit)
+
+    def _enter(self, state):
+        logger.debug("Entering %s", state.id)
+        self.current_state = state
+        events = self.node_events.get(self.language) or self.node_events[DEFAULT_LANGUAGE]
+        self._node_events = events.get(state.id, ())
+
+    # Everything that doesn't touch the state machine is shared with CallTree.
+    to_bytes = CallTree.to_bytes
+    from_bytes = CallTree.__dict__["from_bytes"]
+    values = CallTree.values
+    messages = CallTree.messages
+    sse_events = CallTree.sse_events
+    transition_actions = CallTree.transition_actions
+    _context_delta = CallTree._context_delta
+
+
+def compile_tree(cls):
+    """Flattens a CallTree class into a TableCallTree subclass."""
+
+    table = {
+        (state.id, transition.event): transition.target
+        for state in cls.states
+        for transition in state.transitions
+    }
+    attrs = {
+        "__slots__": (),
+        "definition": cls,
+        "tree_name": cls.tree_name,
+        "node_events": cls.node_events,
+        "compact_prompts": cls.compact_prompts,
+        "allowed_events": cls.allowed_events,
+        "node_actions": cls.node_actions,
+        "initial_prompt": cls.initial_prompt,
+        "initial_tools": cls.initial_tools,
+        "states": cls.states,
+        "states_map": cls.states_map,
+        "initial_state_id": next(s.id for s in cls.states if s.initial),
+        "table": table,
+    }
+    return type(cls.__name__.replace("CallTree", "TableCallTree"), (TableCallTree,), attrs)
@@ -0,0 +1,63 @@
+import asyncio
+import weakref
+from collections import OrderedDict
+
+
+class ConversationLocks:
+    """Hands out one asyncio lock per conversation, so a conversation's webhooks
+    are handled one at a time. Locks are dropped once nobody holds them."""
+
+    def __init__(self):
+        self._locks = weakref.WeakValueDictionary()
+
+    def get(self, conversation_id):
+        lock = self._locks.get(conversation_id)
+        if lock is None:
+            lock = self._locks[conversation_id] = asyncio.Lock()
+        return lock
+
+
+class ResponseCache:
+    """Remembers the SSE events produced for each conversation's recent tool
+    calls, so a retried webhook can be answered with the same response instead
+    of sending the function call to the CallTree again.
+
+    Keeps the last `per_conversation` responses for each of the
+    `max_conversations` most recently active conversations.
+    """
+
+    def __init__(self, max_conversations=10000, per_conversation=8):
+        self.max_conversations = max_conversations
+        self.per_conversation = per_conversation
+        self._conversations = OrderedDict()
+
+    def get(self, conversation_id, tool_call_id):
+        responses = self._conversations.get(conversation_id)
+        if responses is None:
+            return None
+        entry = responses.get(tool_call_id)
+        return entry[1] if entry else None
+
+    def last(self, conversation_id):
+        """Returns the (function name, events) of the conversation's latest
+        response, or None."""
+
+        responses = self._conversations.get(conversation_id)
+        if not responses:
+            return None
+        return next(reversed(responses.values()))
+
+    def put(self, conversation_id, tool_call_id, function_name, events):
+        responses = self._conversations.get(conversation_id)
+        if responses is None:
+            responses = self._conversations[conversation_id] = OrderedDict()
+            if len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+        else:
+            self._conversations.move_to_end(conversation_id)
+        responses[tool_call_id] = (function_name, events)
+        if len(responses) > self.per_conversation:
+            responses.popitem(last=False)
+
+    def discard(self, conversation_id):
+        self._conversations.pop(conversation_id, None)
@@ -0,0 +1,85 @@
+from sse import SSEResponse, compile_messages, escape_values
+
+LANGUAGES = {
+    "english": {
+        "value": "en-US",
+        "tts_model": "sonic-english",
+        "stt_model": "nova-2-conversationalai",
+        "default_voice": "79a125e8-cd45-4c13-8a67-188112f4dd22",
+    },
+    "french": {
+        "value": "fr",
+        "tts_model": "sonic-multilingual",
+        "stt_model": "nova-2-general",
+        "default_voice": "a8a1eb38-5f15-4c1d-8722-7ac0f329727d",
+    },
+    "spanish": {
+        "value": "es",
+        "tts_model": "sonic-multilingual",
+        "stt_model": "nova-2-general",
+        "default_voice": "846d6cb0-2301-48b6-9683-48f5618ea2f6",
+    },
+    "german": {
+        "value": "de",
+        "tts_model": "sonic-multilingual",
+        "stt_model": "nova-2-general",
+        "default_voice": "b9de4a89-2257-424b-94c2-db18ba68c81a",
+    },
+}
+
+
+def language_messages(name, lang):
+    """The RTVI messages that switch the bot to a language and answer the LLM's
+    change_language function call."""
+
+    return [
+        {
+            "update-config": {
+                "config": [
+                    {
+                        "service": "tts",
+                        "options": [
+                            {"name": "voice", "value": lang["default_voice"]},
+                            {"name": "model", "value": lang["tts_model"]},
+                            {"name": "language", "value": lang["value"]},
+                        ],
+                    },
+                    # { Changing this during the call breaks transcription?
+                    #     "service": "stt",
+                    #     "options": [
+                    #         {"name": "model", "value": lang["stt_model"]},
+                    #         {"name": "language", "value": lang["value"]},
+                    #     ],
+                    # },
+                ]
+            }
+        },
+        {
+            "action": {
+                "service": "llm",
+                "action": "function_result",
+                "arguments": [
+                    {"name": "function_name", "value": "change_language"},
+                    {"name": "tool_call_id", "value": "${tool_call_id}"},
+                    {"name": "arguments", "value": {"language": name}},
+                    {"name": "result", "value": {"language": name}},
+                ],
+            }
+        },
+    ]
+
+
+# Compiled once at import, so switching languages only splices in the
+# tool_call_id.
+LANGUAGE_EVENTS = {
+    name: compile_messages(language_messages(name, lang))
+    for name, lang in LANGUAGES.items()
+}
+
+
+def language_response(name, tool_call_id):
+    """The SSE response that switches the bot to a language."""
+
+    return SSEResponse(
+        LANGUAGE_EVENTS[name], escape_values({"tool_call_id": tool_call_id})
+    )
@@ -0,0 +1,79 @@
+import asyncio
+import heapq
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Lifecycle:
+    """Tracks when each conversation has to be cleaned up.
+
+    A started conversation expires `max_duration` seconds later, when its bot
+    will have hung up. One that reaches a final node expires `linger` seconds
+    after that instead, so retried webhooks can still be answered. Deadlines
+    are kept in a heap and a background task calls `on_expire(conversation_id,
+    ended)` as each one passes, where `ended` says whether the conversation
+    reached a final node first.
+    """
+
+    def __init__(self, max_duration, on_expire, linger=60):
+        self.max_duration = max_duration
+        self.linger = linger
+        self.on_expire = on_expire
+        self._heap = []
+        # conversation id -> (deadline, ended). Heap entries whose deadline
+        # doesn't match are stale and skipped.
+        self._deadlines = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def started(self, conversation_id):
+        self._schedule(conversation_id, time.monotonic() + self.max_duration, False)
+
+    def ended(self, conversation_id):
+        self._schedule(conversation_id, time.monotonic() + self.linger, True)
+
+    def _schedule(self, conversation_id, deadline, ended):
+        self._deadlines[conversation_id] = (deadline, ended)
+        if not self._heap or deadline < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (deadline, conversation_id))
+
+    def _due(self, now):
+        while self._heap and self._heap[0][0] <= now:
+            deadline, conversation_id = heapq.heappop(self._heap)
+            entry = self._deadlines.get(conversation_id)
+            if entry is None or entry[0] != deadline:
+                continue
+            del self._deadlines[conversation_id]
+            yield conversation_id, entry[1]
+
+    async def _run(self):
+        while True:
+            for conversation_id, ended in list(self._due(time.monotonic())):
+                try:
+                    await self.on_expire(conversation_id, ended)
+                except Exception:
+                    logger.exception("Failed to expire conversation %s", conversation_id)
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
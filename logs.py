@@ -0,0 +1,142 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+import zlib
+
+# The conversation the current request or task is handling, stamped on every
+# log record so one call's logs can be followed across requests.
+conversation_id = contextvars.ContextVar("conversation_id", default=None)
+
+
+def truncate(value, max_length):
+    """Shortens long strings anywhere in a log payload."""
+
+    if isinstance(value, str):
+        if len(value) > max_length:
+            return f"{value[:max_length]}... ({len(value)} chars)"
+        return value
+    if isinstance(value, dict):
+        return {k: truncate(v, max_length) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [truncate(v, max_length) for v in value]
+    return value
+
+
+class SamplingFilter(logging.Filter):
+    """Stamps records with the current conversation id, and keeps only a sample
+    of conversations' records below WARNING.
+
+    Sampling is by conversation, so a sampled conversation is logged in full.
+    """
+
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.threshold = int(sample_rate * 10000)
+
+    def filter(self, record):
+        cid = conversation_id.get()
+        record.conversation_id = cid
+        if record.levelno >= logging.WARNING or self.threshold >= 10000:
+            return True
+        if cid is None:
+            return True
+        return zlib.crc32(cid.encode()) % 10000 < self.threshold
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, with any `fields` passed as
+    `extra` included and long strings truncated."""
+
+    def __init__(self, max_length=500):
+        super().__init__()
+        self.max_length = max_length
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": truncate(record.getMessage(), self.max_length),
+        }
+        if record.conversation_id:
+            entry["conversation_id"] = record.conversation_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(truncate(fields, self.max_length))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """A human-readable format for local development."""
+
+    def __init__(self, max_length=500):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+        self.max_length = max_length
+
+    def formatMessage(self, record):
+        message = truncate(super().formatMessage(record), self.max_length)
+        if record.conversation_id:
+            message = f"{message} [{record.conversation_id}]"
+        fields = getattr(record, "fields", None)
+        if fields:
+            message = f"{message} {truncate(fields, self.max_length)}"
+        return message
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to a background thread without formatting them, and drops
+    them rather than block the event loop if that thread falls behind."""
+
+    dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+_listener = None
+
+
+def setup_logging():
+    """Routes all logging through a bounded queue to a writer thread.
+
+    Configured with LOG_LEVEL, LOG_FORMAT ("json" or "text"), LOG_SAMPLE_RATE
+    (the fraction of conversations logged below WARNING) and LOG_MAX_LENGTH
+    (the length long strings are truncated to).
+    """
+
+    global _listener
+    if _listener:
+        return
+    max_length = int(os.getenv("LOG_MAX_LENGTH", "500"))
+    formatter = (
+        TextFormatter(max_length)
+        if os.getenv("LOG_FORMAT", "json") == "text"
+        else JSONFormatter(max_length)
+    )
+    formatter.converter = time.gmtime
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(formatter)
+
+    handler = DroppingQueueHandler(queue.Queue(maxsize=10000))
+    handler.addFilter(SamplingFilter(float(os.getenv("LOG_SAMPLE_RATE", "1.0"))))
+    root = logging.getLogger()
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    root.addHandler(handler)
+
+    _listener = logging.handlers.QueueListener(handler.queue, stream)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -1,33 +1,51 @@
+import asyncio
+import functools
 import json
+import logging
 import os
-import uuid
-from typing import Annotated
+import time
+from contextlib import asynccontextmanager
 
-import aiohttp
-import modal
 from dotenv import load_dotenv
-from fastapi import FastAPI, Header
+from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel
-from starlette.responses import StreamingResponse
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
 from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
 
-from call_tree import CallTree
-
-load_dotenv(override=True)
-
-modal_app = modal.App("phone-tree")
-image = (
-    modal.Image.debian_slim(python_version="3.11")
-    .pip_install("boto3")
-    .pip_install_from_requirements("requirements.txt")
+from actions import ActionContext, ActionRunner
+from bot_config import encode_bot_config
+from bots import BotLauncher
+from call_tree import get_call_tree
+import logs
+import metrics
+from conversations import store_from_env
+from dispositions import DispositionSink
+from idempotency import ConversationLocks, ResponseCache
+from languages import LANGUAGES, language_response
+from lifecycle import Lifecycle
+from patients import (
+    PatientLookupFailed,
+    PatientLookupTimedOut,
+    PatientNotFound,
+    cache_from_env,
 )
+from router import new_id, ring_from_env
+from sse import CLOSE
+from webhooks import FunctionCall, InvalidFunctionCall, error_response
 
-
-class FunctionCallRequest(BaseModel):
-    function_name: str
-    tool_call_id: str
-    arguments: dict
+load_dotenv(override=True)
+logs.setup_logging()
+logger = logging.getLogger(__name__)
+
+class PatientRecord(BaseModel):
+    patient_name: str = "Alice Adams"
+    office_name: str = "Dr. Carlson's office"
+    surgery: str = "knee replacement"
+    documents: list[str] = [
+        "Knee X-ray taken on October 8",
+        "Lab tests performed on October 10",
+    ]
 
 
 class StartRequest(BaseModel):
@@ -36,13 +54,118 @@ class StartRequest(BaseModel):
     callId: str = None
     callDomain: str = None
     dialout: str = None
+    patient: PatientRecord = None
+    tree: str = None
+
+
+class BatchCall(BaseModel):
+    dialout: str
+    patient: PatientRecord = None
+    tree: str = None
+
+
+class BatchStartRequest(BaseModel):
+    calls: list[BatchCall]
 
 
 class LanguageRequest(BaseModel):
     language: str
 
 
+class PrefetchRequest(BaseModel):
+    phones: list[str]
+
+
+class CampaignRequest(BaseModel):
+    file: str
+    calls_per_second: float = None
+    max_concurrent: int = None
+
+
+# Bots hang up after max_duration seconds, so conversations can be forgotten
+# shortly after that.
+MAX_DURATION = int(os.getenv("BOT_MAX_DURATION", "300"))
+
+launcher = BotLauncher()
+conversations = store_from_env(ttl=MAX_DURATION + 60)
+disposition_sink = DispositionSink()
+webhook_locks = ConversationLocks()
+responses = ResponseCache()
+action_runner = ActionRunner()
+# Patients are looked up by phone number from PATIENT_SOURCE, if it's set.
+patients = cache_from_env()
+PATIENT_LOOKUP_TIMEOUT = float(os.getenv("PATIENT_LOOKUP_TIMEOUT", "0.5"))
+campaigns = {}
+# Conversations started by this worker that it hasn't yet seen end or expire.
+# The active_conversations gauge is per worker, and with a shared store
+# another worker may handle a conversation's final webhook.
+active = set()
+
+# /start/batch launches left to finish after their client went away, held here
+# so they aren't garbage collected.
+detached_launches = set()
+
+
+def conversation_over(conversation_id):
+    if conversation_id in active:
+        active.discard(conversation_id)
+        metrics.active_conversations.dec()
+
+
+async def expire_conversation(conversation_id, ended):
+    """Forgets a conversation once its bot has hung up, recording it as expired
+    if it never reached a final node."""
+
+    async with webhook_locks.get(conversation_id):
+        ct = await conversations.get(conversation_id)
+        conversation_over(conversation_id)
+        if not ended and ct is not None and not ct.current_state.final:
+            logs.conversation_id.set(conversation_id)
+            logger.info("Conversation expired on %s", ct.current_state.id)
+            metrics.expired.inc(ct.current_state.id)
+            disposition_sink.record(conversation_id, ct, "expired", {})
+        await conversations.delete(conversation_id)
+        responses.discard(conversation_id)
+
+
+# Conversations are expired a little after their bot's max_duration, and kept
+# for CONVERSATION_LINGER seconds after reaching a final node so retried
+# webhooks can still be replayed.
+lifecycle = Lifecycle(
+    MAX_DURATION + 30,
+    expire_conversation,
+    linger=int(os.getenv("CONVERSATION_LINGER", "60")),
+)
+
+# Behind the router (router.py), each worker only creates conversations that
+# hash to itself, so their webhooks are routed back to it.
+ring = ring_from_env()
+WORKER_NAME = os.getenv("WORKER_NAME")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await launcher.open()
+    disposition_sink.start()
+    lifecycle.start()
+    # Compile the default tree now rather than on the first /start.
+    get_call_tree()
+    yield
+    for _, task in campaigns.values():
+        task.cancel()
+    # Bots these launches started may be dialing, so record them first.
+    await asyncio.gather(*detached_launches)
+    await lifecycle.stop()
+    await action_runner.stop()
+    if patients is not None:
+        await patients.close()
+    await launcher.close()
+    await conversations.close()
+    disposition_sink.stop()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     middleware=[
         Middleware(
             CORSMiddleware,
@@ -51,96 +174,177 @@ app = FastAPI(
             allow_methods=["*"],
             allow_headers=["*"],
         )
-    ]
+    ],
 )
 load_dotenv(override=True)
 
-languages = {
-    "english": {
-        "value": "en-US",
-        "tts_model": "sonic-english",
-        "stt_model": "nova-2-conversationalai",
-        "default_voice": "79a125e8-cd45-4c13-8a67-188112f4dd22",
-    },
-    "french": {
-        "value": "fr",
-        "tts_model": "sonic-multilingual",
-        "stt_model": "nova-2-general",
-        "default_voice": "a8a1eb38-5f15-4c1d-8722-7ac0f329727d",
-    },
-    "spanish": {
-        "value": "es",
-        "tts_model": "sonic-multilingual",
-        "stt_model": "nova-2-general",
-        "default_voice": "846d6cb0-2301-48b6-9683-48f5618ea2f6",
-    },
-    "german": {
-        "value": "de",
-        "tts_model": "sonic-multilingual",
-        "stt_model": "nova-2-general",
-        "default_voice": "b9de4a89-2257-424b-94c2-db18ba68c81a",
-    },
-}
-
-call_trees = {}
-
-
-async def language_changer(function_name, tool_call_id, arguments):
-    """If the LLM calls the change_language function, this function sends RTVI message to change the TTS and STT languages."""
-
-    lang = languages[arguments["language"]]
-    events = [
-        {
-            "update-config": {
-                "config": [
-                    {
-                        "service": "tts",
-                        "options": [
-                            {"name": "voice", "value": lang["default_voice"]},
-                            {"name": "model", "value": lang["tts_model"]},
-                            {"name": "language", "value": lang["value"]},
-                        ],
-                    },
-                    # { Changing this during the call breaks transcription?
-                    #     "service": "stt",
-                    #     "options": [
-                    #         {"name": "model", "value": lang["stt_model"]},
-                    #         {"name": "language", "value": lang["value"]},
-                    #     ],
-                    # },
-                ]
-            }
-        },
-        {
-            "action": {
-                "service": "llm",
-                "action": "function_result",
-                "arguments": [
-                    {"name": "function_name", "value": function_name},
-                    {"name": "tool_call_id", "value": tool_call_id},
-                    {"name": "arguments", "value": arguments},
-                    {
-                        "name": "result",
-                        "value": {"language": arguments["language"]},
-                    },
-                ],
-            }
-        },
-    ]
-    for e in events:
-        for k, v in e.items():
-            yield f"event: {k}\ndata: {json.dumps(v)}\n\n"
-    yield "data:close\n\n"
+async def response_streamer(events):
+    """Streams a node's server-sent events as each is rendered, then closes the
+    stream. Each chunk waits for the client to accept the previous one."""
+
+    with metrics.webhook_stream_seconds.time():
+        for e in events:
+            yield e
+        yield CLOSE
+
 
+def sse_response(events):
+    return StreamingResponse(response_streamer(events), media_type="text/event-stream")
 
-async def response_streamer(messages, function_name, tool_call_id, arguments):
-    """Takes an array of RTVI messages and formats them as server-sent events."""
 
-    for m in messages:
-        print(f"!!! m is: {m}")
-        for k, v in m.items():
-            yield f"event: {k}\ndata: {json.dumps(v)}\n\n"
-    yield "data:close\n\n"
+def error_sse(reason, req=None):
+    """Answers a function call that can't be handled with an error result."""
+
+    metrics.webhook_errors.inc(reason)
+    return Response(error_response(reason, req), media_type="text/event-stream")
+
+
+async def read_function_call(request):
+    """Parses a webhook's function call, or returns None if it isn't one."""
+
+    try:
+        return FunctionCall.parse(await request.body())
+    except InvalidFunctionCall as e:
+        logger.warning("Invalid function call: %s", e)
+        return None
+
+
+async def find_patient(phone):
+    """The patient for a call to or from `phone`, or None if there isn't one.
+
+    Prefetched patients come straight from the cache. Otherwise the lookup
+    gets PATIENT_LOOKUP_TIMEOUT seconds, so a slow scheduling system can't
+    hold up the call, and raises PatientLookupTimedOut if it runs out, or
+    PatientLookupFailed if the scheduling system fails.
+    """
+
+    if patients is None or not phone:
+        return None
+    record = await patients.get(phone, timeout=PATIENT_LOOKUP_TIMEOUT)
+    return PatientRecord(**record) if record else None
+
+
+async def call_patient(patient, phone):
+    """The patient a /start call is about: the one it names, or else the one
+    looked up by `phone`. Only a call with no patient source or phone number
+    to look up gets the example patient. Raises PatientNotFound if the lookup
+    comes back empty, and PatientLookupFailed if it couldn't be made."""
+
+    if patient is not None:
+        return patient
+    if patients is None or not phone:
+        return PatientRecord()
+    patient = await find_patient(phone)
+    if patient is None:
+        raise PatientNotFound(f"No patient found for {phone}")
+    return patient
+
+
+async def launch_bot(
+    patient, tree=None, dialin=None, dialout=None, campaign=None, on_sending=None
+):
+    """Creates a call tree for the patient and starts a bot to walk it.
+
+    `on_sending` is passed on to the launcher. Returns the new conversation
+    id and the bots API response."""
+
+    conversation_id = new_id(ring, WORKER_NAME)
+    logs.conversation_id.set(conversation_id)
+    call_tree = get_call_tree(tree)(
+        patient_name=patient.patient_name,
+        office_name=patient.office_name,
+        surgery=patient.surgery,
+        documents=patient.documents,
+        campaign=campaign,
+    )
+    settings = {}
+    if dialin:
+        settings["dialin_settings"] = dialin
+    if dialout:
+        settings["dialout_settings"] = [{"phoneNumber": dialout}]
+    bot_config = encode_bot_config(
+        conversation_id, call_tree, MAX_DURATION, not dialout, settings
+    )
+    await conversations.create(conversation_id, call_tree)
+    t0 = time.perf_counter()
+    try:
+        response_data = await launcher.start(bot_config, on_sending)
+    except (Exception, asyncio.CancelledError):
+        metrics.bot_start_seconds.observe(time.perf_counter() - t0, "error")
+        await conversations.delete(conversation_id)
+        raise
+    metrics.bot_start_seconds.observe(time.perf_counter() - t0, "ok")
+    # The launch may have waited a long time for a BOT_START_CONCURRENCY slot,
+    # so the conversation's time to live starts again from when the bot did.
+    await conversations.touch(conversation_id, call_tree)
+    metrics.active_conversations.inc()
+    active.add(conversation_id)
+    lifecycle.started(conversation_id)
+    disposition_sink.record_transition(conversation_id, call_tree, None, None)
+    node = call_tree.current_state.id
+    actions = call_tree.transition_actions(None, node)
+    if actions:
+        await action_runner.run(actions, ActionContext(conversation_id, call_tree, node))
+    if logger.isEnabledFor(logging.DEBUG):
+        logged_config = json.loads(bot_config)
+        # Never log the API keys, however short.
+        logged_config.pop("api_keys", None)
+        logger.debug("Bot config", extra={"fields": {"bot_config": logged_config}})
+    return conversation_id, response_data
+
+
+async def batch_streamer(calls):
+    """Launches a batch of dial-outs concurrently and streams each result as
+    newline-delimited JSON as soon as that launch finishes."""
+
+    if patients is not None:
+        # Look every patient up in one batch.
+        patients.prefetch([c.dialout for c in calls if c.patient is None])
+
+    # Launches that have been sent to the bots API, which may already be
+    # dialing, so they're finished even if the client goes away.
+    sending = set()
+
+    async def run(index, call):
+        result = {"index": index, "dialout": call.dialout}
+        try:
+            conversation_id, response_data = await launch_bot(
+                await call_patient(call.patient, call.dialout),
+                tree=call.tree,
+                dialout=call.dialout,
+                on_sending=lambda: sending.add(index),
+            )
+        except Exception as e:
+            result["error"] = str(e)
+        else:
+            result["conversation_id"] = conversation_id
+            result["room_url"] = response_data.get("room_url")
+        return result
+
+    tasks = [asyncio.create_task(run(i, c)) for i, c in enumerate(calls)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield json.dumps(await task) + "\n"
+    finally:
+        # The client went away (or every result was sent). Only cancel the
+        # launches still waiting for a slot.
+        for index, task in enumerate(tasks):
+            if task.done():
+                continue
+            if index in sending:
+                detached_launches.add(task)
+                task.add_done_callback(finish_detached_launch)
+            else:
+                task.cancel()
+
+
+def finish_detached_launch(task):
+    detached_launches.discard(task)
+    if not task.cancelled():
+        logger.info(
+            "Batch launch finished after its client went away",
+            extra={"fields": task.result()},
+        )
 
 
 # If you want to also use this webhook server for a dial-in bot, you can use the
@@ -149,194 +353,273 @@ async def response_streamer(messages, function_name, tool_call_id, arguments):
 async def start(req: StartRequest):
     """POST to this endpoint to start a Daily Bots session."""
 
-    async with aiohttp.ClientSession() as session:
-        conversation_id = str(uuid.uuid4())
-        run_on_config = True
-        if req.dialout:
-            run_on_config = False
-        bot_config = {
-            "bot_profile": "voice_2024_10",
-            "max_duration": "300",
-            "services": {"tts": "cartesia", "llm": "openai"},
-            "api_keys": {"openai": os.getenv("OPENAI_API_KEY", None)},
-            "webhook_tools": {
-                "change_language": {
-                    "url": f"{os.getenv('WEBHOOK_HOST', 'http://localhost:8000')}/language",
-                    "method": "POST",
-                    "streaming": True,
-                    "custom_headers": {"conversation-id": conversation_id},
-                },
-                "*": {
-                    "url": f"{os.getenv('WEBHOOK_HOST', 'http://localhost:8000')}/webhook",
-                    "method": "POST",
-                    "streaming": True,
-                    "custom_headers": {"conversation-id": conversation_id},
-                },
-            },
-            "config": [
-                {
-                    "service": "tts",
-                    "options": [
-                        {
-                            "name": "voice",
-                            "value": "829ccd10-f8b3-43cd-b8a0-4aeaa81f3b30",
-                        }
-                    ],
-                },
-                {
-                    "service": "stt",
-                    "options": [{"name": "model", "value": "nova-2-general"}],
-                },
-                {
-                    "service": "llm",
-                    "options": [
-                        {"name": "model", "value": "gpt-4o"},
-                        {
-                            "name": "initial_messages",
-                            "value": [
-                                {
-                                    "role": "system",
-                                    "content": [
-                                        {
-                                            "type": "text",
-                                            "text": """Conversational Style:
-                                            
-                                            Make sure to ONLY ASK ONE QUESTION at a time to not overwhelm the user and KEEP YOUR questions SHORT. Your communication style should be proactive and lead the conversation, asking targeted questions. Ensure your responses are concise, clear, and maintain a conversational tone. If the user only partially answers a question, RE-ASK the part that they forgot to answer.
-                                            
-                                            Approach the conversation with a professional and courteous tone and be friendly with them.
-                                            
-                                            Ask for information in a clear and concise manner, ensuring not to overwhelm the office staff.
-                                            
-                                            Be patient and give the person on the other end time to respond to your requests.
-                                            
-                                            If the office staff needs time to locate the information, offer to hold or suggest a callback time.
-                                            
-                                            If the office cannot find the patient or encounters any issues, apologize and inform them that someone from the hospital will follow up.
-                                            
-                                            TASK: 
-                                            Today, you are tasked with calling Dr. Carlson's office to collect specific medical information about their patient Alice Adams scheduled for knee replacement surgery. 
-                                            
-                                            Start by confirming you are speaking to the correct office. If this is Dr. Carlson's office, call the 'confirmed_office' function. If it's not, call the 'wrong_number' function.""",
-                                        }
-                                    ],
-                                }
-                            ],
-                        },
-                        {
-                            "name": "tools",
-                            "value": [
-                                {
-                                    "type": "function",
-                                    "function": {
-                                        "name": "confirmed_office",
-                                        "description": "Call this function when the user confirms they're with Dr. Carlson's office.",
-                                        "parameters": {
-                                            "type": "object",
-                                            "properties": {
-                                                "office": {
-                                                    "type": "string",
-                                                    "description": "The name of the office you're calling.",
-                                                },
-                                            },
-                                            "required": ["office"],
-                                        },
-                                    },
-                                },
-                                {
-                                    "type": "function",
-                                    "function": {
-                                        "name": "wrong_number",
-                                        "description": "Call this function if the user says you've called the wrong number.",
-                                        "parameters": {
-                                            "type": "object",
-                                            "properties": {
-                                                "office": {
-                                                    "type": "string",
-                                                    "description": "The name of the office you're calling.",
-                                                },
-                                            },
-                                            "required": ["office"],
-                                        },
-                                    },
-                                },
-                            ],
-                        },
-                        {"name": "run_on_config", "value": run_on_config},
-                    ],
-                },
-            ],
-        }
-        call_trees[conversation_id] = CallTree(
-            patient_name="Alice Adams",
-            office_name="Dr. Carlson's office",
-            surgery="knee replacement",
-            documents=[
-                "Knee X-ray taken on October 8",
-                "Lab tests performed on October 10",
-            ],
+    dialin = None
+    if req.callId:
+        dialin = {"callId": req.callId, "callDomain": req.callDomain}
+    try:
+        call_tree = get_call_tree(req.tree)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        patient = await call_patient(req.patient, req.From if dialin else req.dialout)
+    except PatientNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except PatientLookupTimedOut as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except PatientLookupFailed as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    _, response_data = await launch_bot(
+        patient,
+        tree=call_tree.tree_name,
+        dialin=dialin,
+        dialout=req.dialout,
+    )
+    logger.info(
+        "Room to join: %s?t=%s", response_data["room_url"], response_data["token"]
+    )
+    return response_data
+
+
+@app.post("/start/batch")
+async def start_batch(req: BatchStartRequest):
+    """POST a list of dial-out numbers and patients to start many bots at once.
+
+    Launches run concurrently, bounded by BOT_START_CONCURRENCY, and each
+    result is streamed back as a line of JSON as it completes."""
+
+    return StreamingResponse(
+        batch_streamer(req.calls), media_type="application/x-ndjson"
+    )
+
+
+async def launch_campaign_call(call, campaign=None):
+    if call["patient_name"]:
+        patient = PatientRecord(
+            patient_name=call["patient_name"],
+            office_name=call["office_name"],
+            surgery=call["surgery"],
+            documents=call["documents"],
         )
-        if req.callId:
-            bot_config["dialin_settings"] = {
-                "callId": req.callId,
-                "callDomain": req.callDomain,
-            }
-        if req.dialout:
-            bot_config["dialout_settings"] = [{"phoneNumber": req.dialout}]
-        headers = {"Authorization": f"Bearer {os.getenv('DAILY_API_KEY')}"}
-        response_data = {}
-        r = await session.post(
-            os.getenv("BOT_START_URL", "https://api.daily.co/v1/bots/start"),
-            headers=headers,
-            json=bot_config,
+    else:
+        patient = await find_patient(call["phone"])
+        if patient is None:
+            # Fails the launch, so the campaign records it as start_failed.
+            raise PatientNotFound(f"No patient found for {call['phone']}")
+    conversation_id, _ = await launch_bot(
+        patient,
+        tree=call["tree"],
+        dialout=call["phone"],
+        campaign=campaign,
+    )
+    return conversation_id
+
+
+async def conversation_state(conversation_id):
+    ct = await conversations.get(conversation_id)
+    return ct.current_state if ct else None
+
+
+@app.post("/campaigns")
+async def start_campaign(req: CampaignRequest):
+    """POST the name of a campaign file in CAMPAIGN_DIR to start dialing it.
+
+    Starting the same file again after a restart resumes from its checkpoint.
+    A file that's still being dialed can't be started again."""
+
+    campaign_dir = os.getenv("CAMPAIGN_DIR", "campaigns")
+    path = os.path.join(campaign_dir, req.file)
+    if os.path.basename(req.file) != req.file or not os.path.isfile(path):
+        raise HTTPException(status_code=400, detail=f"No campaign file: {req.file}")
+    from campaign import Campaign, CampaignRunning
+
+    campaign = Campaign(
+        path,
+        functools.partial(launch_campaign_call, campaign=req.file),
+        conversation_state,
+        max_duration=MAX_DURATION,
+        calls_per_second=req.calls_per_second,
+        max_concurrent=req.max_concurrent,
+        prefetch=patients.prefetch if patients is not None else None,
+    )
+    try:
+        campaign.claim()
+    except CampaignRunning:
+        running = next(
+            (i for i, (c, t) in campaigns.items() if c.path == path and not t.done()), None
         )
-        if r.status != 200:
-            text = await r.text()
-            raise Exception(f"Problem starting a bot worker: {text}")
+        detail = f"Campaign {req.file} is already running"
+        if running:
+            detail += f" as {running}"
+        raise HTTPException(status_code=409, detail=detail)
+    campaign_id = new_id(ring, WORKER_NAME)
+    task = asyncio.create_task(campaign.run())
+    # A task cancelled before it starts never runs run's cleanup.
+    task.add_done_callback(lambda t: campaign.release())
+    task.add_done_callback(
+        lambda t: t.cancelled()
+        or t.exception() is None
+        or logger.error("Campaign %s failed", campaign_id, exc_info=t.exception())
+    )
+    campaigns[campaign_id] = (campaign, task)
+    return {"campaign_id": campaign_id, **campaign.progress()}
+
+
+@app.post("/patients/prefetch")
+async def prefetch_patients(req: PrefetchRequest):
+    """POST the phone numbers of upcoming calls, or of offices expected to
+    call in, to look their patients up ahead of time."""
 
-        response_data = await r.json()
-        print(f"Bot config: {bot_config}")
-        print(f"Room to join: {response_data['room_url']}?t={response_data['token']}")
-        return response_data
+    if patients is None:
+        raise HTTPException(status_code=400, detail="PATIENT_SOURCE isn't set")
+    patients.prefetch(req.phones)
+    return {"queued": len(req.phones)}
+
+
+@app.get("/campaigns/{campaign_id}")
+async def campaign_progress(campaign_id: str):
+    if campaign_id not in campaigns:
+        raise HTTPException(status_code=404, detail="Unknown campaign")
+    return campaigns[campaign_id][0].progress()
 
 
 @app.post("/language")
-async def set_language(req: FunctionCallRequest):
+async def set_language(request: Request):
     """The LLM will POST a webhook to this endpoint if it calls the change_lanugage function."""
 
-    print("Language request received: req")
-    return StreamingResponse(
-        language_changer(req.function_name, req.tool_call_id, req.arguments),
-        media_type="text/event-stream",
+    conversation_id = request.headers.get("conversation-id")
+    logs.conversation_id.set(conversation_id)
+    req = await read_function_call(request)
+    if req is None:
+        return error_sse("invalid_request")
+    logger.info(
+        "Language request received",
+        extra={"fields": {"tool_call_id": req.tool_call_id, "arguments": req.arguments}},
     )
+    language = req.arguments.get("language")
+    if language not in LANGUAGES:
+        return error_sse("unsupported_language", req)
+    if conversation_id:
+        # Later pages of the call tree are sent in the new language.
+        async with webhook_locks.get(conversation_id):
+            ct = await conversations.get(conversation_id)
+            if ct is not None:
+                ct.language = language
+                await conversations.save(conversation_id, ct)
+    return sse_response(language_response(language, req.tool_call_id))
 
 
 @app.post("/webhook")
-async def webhook(
-    req: FunctionCallRequest, conversation_id: Annotated[str | None, Header()] = None
-):
+async def webhook(request: Request):
     """This is the webhook endpoint used for calling all the call tree functions."""
 
-    print(f"!!! got a webhook function call: {req}, conversation_id: {conversation_id}")
-    ct = call_trees[conversation_id]
+    conversation_id = request.headers.get("conversation-id")
+    logs.conversation_id.set(conversation_id)
+    req = await read_function_call(request)
+    if req is None:
+        return error_sse("invalid_request")
+    logger.info(
+        "Webhook function call: %s",
+        req.function_name,
+        extra={"fields": {"tool_call_id": req.tool_call_id, "arguments": req.arguments}},
+    )
+    return await handle_function_call(conversation_id, req)
+
+
+async def handle_function_call(conversation_id, req):
+    """Sends a webhook's function call to the conversation's CallTree and
+    returns the response.
+
+    Webhooks for the same conversation are handled one at a time. A retried
+    webhook (same tool_call_id), or the LLM repeating the function call that
+    got the tree to its current node, gets the earlier response again instead
+    of a second transition. Calls for unknown conversations, or that don't
+    leave the current node, get an error result for the LLM.
+    """
+
+    async with webhook_locks.get(conversation_id):
+        events = responses.get(conversation_id, req.tool_call_id)
+        if events is not None:
+            logger.info("Replaying response to tool call %s", req.tool_call_id)
+            metrics.webhook_replays.inc("tool_call_id")
+            return sse_response(events)
+
+        ct = await conversations.get(conversation_id) if conversation_id else None
+        if ct is None:
+            logger.warning("Function call for unknown conversation")
+            return error_sse("unknown_conversation", req)
+
+        source = ct.current_state.id
+        if req.function_name not in ct.allowed_events[source]:
+            last = responses.last(conversation_id)
+            if last and last[0] == req.function_name:
+                logger.info("Replaying response to repeated %s", req.function_name)
+                metrics.webhook_replays.inc("repeated_call")
+                return sse_response(last[1])
+            logger.warning("%s can't be called on %s", req.function_name, source)
+            return error_sse("not_allowed", req)
+        t0 = time.perf_counter()
+        ct.send(req.function_name)
+        metrics.webhook_send_seconds.observe(time.perf_counter() - t0, req.function_name)
+        events = ct.sse_events()
+        await conversations.save(conversation_id, ct)
+        responses.put(conversation_id, req.tool_call_id, req.function_name, events)
+
+    target = ct.current_state
+    metrics.transitions.inc(source, target.id)
+    disposition_sink.record_transition(conversation_id, ct, source, req.function_name)
+    if target.final:
+        lifecycle.ended(conversation_id)
+        conversation_over(conversation_id)
+        metrics.dispositions.inc(target.id)
+        disposition_sink.record(conversation_id, ct, req.function_name, req.arguments)
+    logger.info("Machine state: %s", target.id)
+    actions = ct.transition_actions(source, target.id)
+    if actions:
+        # Critical actions hold up the response, the rest run in the background.
+        await action_runner.run(
+            actions,
+            ActionContext(conversation_id, ct, target.id, req.function_name, req.arguments),
+        )
+    return sse_response(events)
 
-    ct.send(req.function_name)
 
-    print(f"!!! machine state: {ct.current_state.name}")
-    print(f"!!! messages: {ct.messages}")
-    return StreamingResponse(
-        response_streamer(
-            ct.messages, req.function_name, req.tool_call_id, req.arguments
-        ),
-        media_type="text/event-stream",
+@app.get("/stats")
+async def get_stats(
+    by: str = None,
+    campaign: str = None,
+    office: str = None,
+    tree: str = None,
+    since: float = None,
+    until: float = None,
+):
+    """Funnel, drop-off and dwell time for each call tree page, from the
+    transition log. See analytics.py."""
+
+    import analytics
+
+    if by is not None and by not in analytics.GROUPS:
+        raise HTTPException(status_code=400, detail=f"Can't group by {by}")
+    return await asyncio.to_thread(
+        analytics.stats,
+        disposition_sink.path,
+        by=by,
+        in_progress_after=time.time() - MAX_DURATION,
+        campaign=campaign,
+        office=office,
+        tree=tree,
+        since=since,
+        until=until,
     )
 
 
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics for this worker."""
+
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/")
 def homepage():
     return {"hello": "world"}
 
-
-@modal_app.function(image=image, secrets=[modal.Secret.from_name("my-custom-secret")])
-@modal.asgi_app()
-def fastapi_app():
-    return app
@@ -0,0 +1,193 @@
+import bisect
+import time
+
+# Metrics are only updated from the event loop thread, so there are no locks.
+# Each uvicorn worker keeps and exports its own series.
+REGISTRY = []
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._series = {}
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self._series.items():
+            lines.extend(self._render_series(labels, value))
+        return lines
+
+    def _render_series(self, labels, value):
+        return [f"{self.name}{_labels(self.label_names, labels)} {value}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        self._series[labels] = self._series.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self._series[labels] = value
+
+    def inc(self, *labels, amount=1):
+        self._series[labels] = self._series.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            # One count per bucket plus +Inf, then the sum.
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def _render_series(self, labels, series):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), series):
+            cumulative += count
+            le = _labels(self.label_names + ("le",), labels + (bound,))
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+        base = _labels(self.label_names, labels)
+        lines.append(f"{self.name}_sum{base} {series[-1]}")
+        lines.append(f"{self.name}_count{base} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+def render():
+    """Renders every metric in the Prometheus text exposition format."""
+
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+bot_start_seconds = Histogram(
+    "bot_start_seconds",
+    "Time to start a bot with the Daily Bots API, including retries.",
+    labels=("outcome",),
+)
+webhook_send_seconds = Histogram(
+    "webhook_send_seconds",
+    "Time spent sending a webhook's function call to its CallTree.",
+    labels=("function_name",),
+)
+webhook_stream_seconds = Histogram(
+    "webhook_stream_seconds",
+    "Time spent streaming a webhook's server-sent events to the bot.",
+)
+webhook_replays = Counter(
+    "webhook_replays_total",
+    "Webhooks answered with an earlier response instead of a new transition.",
+    labels=("reason",),
+)
+transitions = Counter(
+    "call_tree_transitions_total",
+    "CallTree transitions, by source and target node.",
+    labels=("source", "target"),
+)
+active_conversations = Gauge(
+    "active_conversations",
+    "Conversations started that haven't reached a final node.",
+)
+dispositions = Counter(
+    "call_tree_dispositions_total",
+    "Conversations that reached each final node.",
+    labels=("node",),
+)
+expired = Counter(
+    "call_tree_expired_total",
+    "Conversations whose bot hung up before reaching a final node, by the node "
+    "they were on.",
+    labels=("node",),
+)
+prompt_tokens = Histogram(
+    "call_tree_prompt_tokens",
+    "Estimated tokens in each node prompt sent to a bot, by node.",
+    labels=("node",),
+    buckets=(25, 50, 100, 200, 400, 800, 1600, 3200),
+)
+context_skipped = Counter(
+    "call_tree_context_skipped_total",
+    "Node tools and prompts left out because the bot already had them, or "
+    "prompts sent compacted to stay within the context budget.",
+    labels=("kind",),
+)
+webhook_errors = Counter(
+    "webhook_errors_total",
+    "Webhooks answered with an error result: unreadable bodies, unknown "
+    "conversations and function calls the current node doesn't allow.",
+    labels=("reason",),
+)
+action_seconds = Histogram(
+    "call_tree_action_seconds",
+    "Time taken by each node entry and exit action.",
+    labels=("action",),
+)
+action_outcomes = Counter(
+    "call_tree_action_outcomes_total",
+    "Node actions by outcome: ok, error, timeout, or dropped because too many "
+    "background actions were running.",
+    labels=("action", "outcome"),
+)
+patient_lookups = Counter(
+    "patient_lookups_total",
+    "Patient lookups by result: hit (already cached), miss (fetched), timeout "
+    "or error.",
+    labels=("result",),
+)
+patient_fetch_seconds = Histogram(
+    "patient_fetch_seconds",
+    "Time taken by each batch fetch from the patient provider.",
+)
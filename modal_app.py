@@ -0,0 +1,22 @@
+"""Deploys the webhook server to Modal with `modal deploy modal_app.py`.
+
+Kept out of main.py so the server doesn't import Modal when it runs under
+plain uvicorn.
+"""
+
+import modal
+
+modal_app = modal.App("phone-tree")
+image = (
+    modal.Image.debian_slim(python_version="3.11")
+    .pip_install("boto3")
+    .pip_install_from_requirements("requirements.txt")
+)
+
+
+@modal_app.function(image=image, secrets=[modal.Secret.from_name("my-custom-secret")])
+@modal.asgi_app()
+def fastapi_app():
+    from main import app
+
+    return app
@@ -0,0 +1,274 @@
+"""Looks up the patient a call is about, by the office's phone number, ahead
+of the call.
+
+A PatientProvider fetches patient records from the scheduling system in
+batches. The stand-ins here read them from a SQLite database or a JSON file
+of {phone: record}, named by PATIENT_SOURCE. PatientCache sits in front of
+the provider: it's warmed with `prefetch` before scheduled dial-outs (or
+for numbers expected to call in), holds records for PATIENT_CACHE_TTL
+seconds (numbers with no patient for PATIENT_CACHE_MISS_TTL), and coalesces
+concurrent lookups into one fetch.
+
+Load a campaign file's patients into a SQLite stand-in with:
+
+    python -m patients --db patients.db --load campaigns/example.csv
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("patient_name", "office_name", "surgery", "documents")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    phone TEXT PRIMARY KEY,
+    patient_name TEXT NOT NULL,
+    office_name TEXT NOT NULL,
+    surgery TEXT NOT NULL,
+    documents TEXT NOT NULL
+);
+"""
+
+
+class PatientNotFound(LookupError):
+    """No patient could be found for a call's phone number."""
+
+
+class PatientLookupFailed(Exception):
+    """The scheduling system couldn't say whether a phone number has a patient."""
+
+
+class PatientLookupTimedOut(PatientLookupFailed):
+    """The scheduling system didn't answer a lookup in time."""
+
+
+class PatientProvider:
+    """Base class for the systems patient records are fetched from."""
+
+    async def fetch(self, phones):
+        """Returns {phone: record} for the phones with a patient. Records have
+        the keys in FIELDS, with `documents` as a list."""
+
+        raise NotImplementedError
+
+
+class SQLitePatientProvider(PatientProvider):
+    """Reads patients from the `patients` table of a SQLite database, in a
+    worker thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._lock = threading.Lock()
+
+    async def fetch(self, phones):
+        return await asyncio.to_thread(self._fetch, list(phones))
+
+    def _fetch(self, phones):
+        with self._lock:
+            if self._db is None:
+                self._db = connect(self.path, check_same_thread=False)
+            records = {}
+            # Stay under SQLite's limit on query parameters.
+            for i in range(0, len(phones), 500):
+                chunk = phones[i : i + 500]
+                rows = self._db.execute(
+                    f"SELECT phone, {', '.join(FIELDS)} FROM patients "
+                    f"WHERE phone IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for phone, *values in rows:
+                    record = dict(zip(FIELDS, values))
+                    record["documents"] = json.loads(record["documents"])
+                    records[phone] = record
+            return records
+
+
+class JSONPatientProvider(PatientProvider):
+    """Reads patients from a JSON file of {phone: record}, re-reading it when
+    it changes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self._records = {}
+
+    async def fetch(self, phones):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self._mtime:
+            self._records = await asyncio.to_thread(self._load)
+            self._mtime = mtime
+        return {p: self._records[p] for p in phones if p in self._records}
+
+    def _load(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+
+def connect(path, **kwargs):
+    db = sqlite3.connect(path, timeout=30, **kwargs)
+    db.executescript(SCHEMA)
+    return db
+
+
+def provider_from_env():
+    """The provider for PATIENT_SOURCE, a .db or .json file, or None."""
+
+    source = os.getenv("PATIENT_SOURCE")
+    if not source:
+        return None
+    if source.endswith(".json"):
+        return JSONPatientProvider(source)
+    return SQLitePatientProvider(source)
+
+
+class PatientCache:
+    """Caches patient records by phone number in front of a PatientProvider.
+
+    Records are kept for `ttl` seconds and numbers with no patient for
+    `miss_ttl`, so a patient added to the scheduling system after its number
+    was looked up is found soon after. The least recently used are dropped
+    past `max_size`. Lookups for numbers that
+    aren't cached are collected for `batch_delay` seconds and fetched together,
+    and concurrent lookups for the same number share one fetch.
+    """
+
+    def __init__(self, provider, ttl=None, miss_ttl=None, max_size=None, batch_delay=0.005):
+        self.provider = provider
+        self.ttl = ttl or float(os.getenv("PATIENT_CACHE_TTL", "3600"))
+        self.miss_ttl = miss_ttl or float(os.getenv("PATIENT_CACHE_MISS_TTL", "60"))
+        self.max_size = max_size or int(os.getenv("PATIENT_CACHE_MAX_SIZE", "100000"))
+        self.batch_delay = batch_delay
+        # phone -> (expires_at, record or None)
+        self._records = OrderedDict()
+        # phone -> future for a fetch in flight
+        self._pending = {}
+        self._batch = []
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._records)
+
+    def cached(self, phone):
+        """Returns (found, record) from the cache alone, without any I/O."""
+
+        entry = self._records.get(phone)
+        if entry is None:
+            return False, None
+        if entry[0] < time.monotonic():
+            del self._records[phone]
+            return False, None
+        self._records.move_to_end(phone)
+        return True, entry[1]
+
+    async def get(self, phone, timeout=None):
+        """Returns the patient record for `phone`, or None if there isn't one.
+
+        Raises PatientLookupTimedOut if it didn't arrive within `timeout`
+        seconds, and PatientLookupFailed if the provider failed.
+        """
+
+        found, record = self.cached(phone)
+        if found:
+            metrics.patient_lookups.inc("hit")
+            return record
+        try:
+            record = await asyncio.wait_for(asyncio.shield(self._request(phone)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Patient lookup for %s timed out", phone)
+            metrics.patient_lookups.inc("timeout")
+            raise PatientLookupTimedOut(f"Patient lookup for {phone} timed out") from None
+        except Exception as e:
+            logger.warning("Patient lookup for %s failed: %s", phone, e)
+            metrics.patient_lookups.inc("error")
+            raise PatientLookupFailed(f"Patient lookup for {phone} failed: {e}") from e
+        metrics.patient_lookups.inc("miss")
+        return record
+
+    def prefetch(self, phones):
+        """Starts fetching any of `phones` that aren't cached, without waiting."""
+
+        for phone in phones:
+            if not self.cached(phone)[0]:
+                # Failures are logged by the fetch.
+                self._request(phone).add_done_callback(
+                    lambda f: f.cancelled() or f.exception()
+                )
+
+    def _request(self, phone):
+        future = self._pending.get(phone)
+        if future is None:
+            future = self._pending[phone] = asyncio.get_running_loop().create_future()
+            if not self._batch:
+                task = asyncio.create_task(self._fetch_batch())
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            self._batch.append(phone)
+        return future
+
+    async def _fetch_batch(self):
+        await asyncio.sleep(self.batch_delay)
+        phones, self._batch = self._batch, []
+        t0 = time.perf_counter()
+        try:
+            records = await self.provider.fetch(phones)
+        except Exception as e:
+            logger.exception("Failed to fetch %d patients", len(phones))
+            for phone in phones:
+                self._pending.pop(phone).set_exception(e)
+            return
+        metrics.patient_fetch_seconds.observe(time.perf_counter() - t0)
+        now = time.monotonic()
+        for phone in phones:
+            record = records.get(phone)
+            expires_at = now + (self.ttl if record is not None else self.miss_ttl)
+            self._records[phone] = (expires_at, record)
+            self._records.move_to_end(phone)
+            self._pending.pop(phone).set_result(record)
+        while len(self._records) > self.max_size:
+            self._records.popitem(last=False)
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def cache_from_env():
+    """A PatientCache for PATIENT_SOURCE, or None if it isn't set."""
+
+    provider = provider_from_env()
+    return PatientCache(provider) if provider else None
+
+
+if __name__ == "__main__":
+    from campaign import load_calls
+
+    parser = argparse.ArgumentParser(description="Load patients into a SQLite stand-in.")
+    parser.add_argument("--db", default="patients.db")
+    parser.add_argument("--load", required=True, help="a campaign CSV or JSONL file")
+    args = parser.parse_args()
+    db = connect(args.db)
+    # Rows without a patient are the ones that rely on being looked up.
+    calls = [c for c in load_calls(args.load) if c["patient_name"]]
+    with db:
+        db.executemany(
+            "INSERT OR REPLACE INTO patients VALUES (?, ?, ?, ?, ?)",
+            [
+                (c["phone"], c["patient_name"], c["office_name"], c["surgery"],
+                 json.dumps(c["documents"]))
+                for c in calls
+            ],
+        )
+    print(f"Loaded {len(calls)} patients into {args.db}")
@@ -0,0 +1,291 @@
+"""Runs several uvicorn workers behind a router that keeps each conversation
+on the worker that owns it.
+
+Conversations are assigned to workers by consistent hashing of their id, and
+each worker only hands out conversation ids that hash to itself, so the
+router can send every webhook to the worker holding its CallTree, lock and
+cached responses without keeping any state of its own.
+
+    python -m router --port 8000 --workers 4
+"""
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import itertools
+import os
+import re
+import subprocess
+import sys
+import uuid
+
+from aiohttp import (
+    ClientConnectorError,
+    ClientSession,
+    ClientTimeout,
+    TCPConnector,
+    web,
+)
+
+# Per-connection headers that aren't passed between client, router and worker.
+HOP_BY_HOP = {
+    "connection",
+    "content-length",
+    "host",
+    "keep-alive",
+    "transfer-encoding",
+}
+
+CAMPAIGN_PATH = re.compile(r"^/campaigns/([^/]+)$")
+
+
+def _point(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Maps keys to nodes by consistent hashing, with `replicas` points per
+    node so keys spread evenly and adding a node only moves its share."""
+
+    def __init__(self, nodes, replicas=100):
+        self.nodes = list(nodes)
+        points = sorted(
+            (_point(f"{node}#{i}"), node)
+            for node in self.nodes
+            for i in range(replicas)
+        )
+        self._points = [p for p, _ in points]
+        self._owners = [n for _, n in points]
+
+    def owner(self, key):
+        i = bisect.bisect(self._points, _point(key)) % len(self._points)
+        return self._owners[i]
+
+
+def ring_from_env():
+    """The ring this worker belongs to, from ROUTER_WORKERS, or None when the
+    server isn't running behind the router.
+
+    Raises ValueError if WORKER_NAME isn't one of ROUTER_WORKERS, since the
+    worker could never mint an id that hashes to itself.
+    """
+
+    workers = os.getenv("ROUTER_WORKERS")
+    if not workers:
+        return None
+    workers = workers.split(",")
+    worker = os.getenv("WORKER_NAME")
+    if worker not in workers:
+        raise ValueError(f"WORKER_NAME {worker!r} isn't one of ROUTER_WORKERS {workers}")
+    return HashRing(workers)
+
+
+def new_id(ring=None, worker=None):
+    """A new conversation or campaign id, owned by `worker` if it's on a ring."""
+
+    while True:
+        key = str(uuid.uuid4())
+        if ring is None or ring.owner(key) == worker:
+            return key
+
+
+def relabel(text, worker):
+    """Adds a worker label to every sample of a Prometheus text exposition."""
+
+    lines = []
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            lines.append(line)
+            continue
+        name, _, rest = line.partition(" ")
+        if name.endswith("}"):
+            name = f'{name[:-1]},worker="{worker}"}}'
+        else:
+            name = f'{name}{{worker="{worker}"}}'
+        lines.append(f"{name} {rest}")
+    return lines
+
+
+def merge_metrics(texts):
+    """Merges the /metrics of several workers into one exposition, keeping a
+    single HELP and TYPE line per metric."""
+
+    seen = set()
+    lines = []
+    for worker, text in texts.items():
+        for line in relabel(text, worker):
+            if line.startswith("#"):
+                if line in seen:
+                    continue
+                seen.add(line)
+            if line:
+                lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def make_app(upstreams):
+    """The router app, forwarding to `upstreams`, a dict of worker name to URL."""
+
+    ring = HashRing(upstreams)
+    round_robin = itertools.cycle(upstreams)
+    app = web.Application()
+
+    async def on_startup(app):
+        app["session"] = ClientSession(
+            connector=TCPConnector(limit=0),
+            timeout=ClientTimeout(total=None, sock_connect=5),
+            auto_decompress=False,
+        )
+
+    async def on_cleanup(app):
+        await app["session"].close()
+
+    def pick(request):
+        key = request.headers.get("conversation-id")
+        if key is None:
+            match = CAMPAIGN_PATH.match(request.path)
+            key = match and match.group(1)
+        return ring.owner(key) if key else next(round_robin)
+
+    async def proxy(request):
+        worker = pick(request)
+        headers = {
+            k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP
+        }
+        try:
+            upstream = await app["session"].request(
+                request.method,
+                upstreams[worker] + request.rel_url.path_qs,
+                headers=headers,
+                data=await request.read(),
+            )
+        except ClientConnectorError:
+            return web.Response(status=502, text=f"{worker} is unavailable")
+        async with upstream:
+            response = web.StreamResponse(
+                status=upstream.status,
+                headers={
+                    k: v
+                    for k, v in upstream.headers.items()
+                    if k.lower() not in HOP_BY_HOP
+                },
+            )
+            await response.prepare(request)
+            try:
+                # Pass SSE events through as they arrive rather than buffering.
+                async for chunk in upstream.content.iter_any():
+                    await response.write(chunk)
+                await response.write_eof()
+            except ConnectionResetError:
+                pass  # The client hung up.
+            return response
+
+    async def get_metrics(request):
+        async def fetch(worker, url):
+            async with app["session"].get(url + "/metrics") as r:
+                return worker, await r.text()
+
+        try:
+            texts = dict(
+                await asyncio.gather(*(fetch(w, u) for w, u in upstreams.items()))
+            )
+        except ClientConnectorError as e:
+            return web.Response(status=502, text=str(e))
+        return web.Response(
+            body=merge_metrics(texts).encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4"},
+        )
+
+    async def broadcast(request):
+        """Sends a request to every worker, since each keeps its own cache,
+        and answers with the first failure or else the first response."""
+
+        body = await request.read()
+        headers = {
+            k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP
+        }
+
+        async def send(url):
+            async with app["session"].request(
+                request.method, url + request.rel_url.path_qs, headers=headers, data=body
+            ) as r:
+                return r.status, r.content_type, await r.read()
+
+        try:
+            responses = await asyncio.gather(*(send(u) for u in upstreams.values()))
+        except ClientConnectorError as e:
+            return web.Response(status=502, text=str(e))
+        status, content_type, body = next(
+            (r for r in responses if r[0] >= 400), responses[0]
+        )
+        return web.Response(status=status, body=body, content_type=content_type)
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_get("/metrics", get_metrics)
+    # Every worker prefetches patients into its own cache.
+    app.router.add_post("/patients/prefetch", broadcast)
+    app.router.add_route("*", "/{tail:.*}", proxy)
+    return app
+
+
+def spawn_workers(count, base_port, env=None):
+    """Starts `count` uvicorn workers on consecutive ports and returns the
+    processes and a dict of worker name to URL."""
+
+    upstreams = {f"worker-{i}": f"http://127.0.0.1:{base_port + i}" for i in range(count)}
+    processes = []
+    for i, name in enumerate(upstreams):
+        processes.append(
+            subprocess.Popen(
+                [
+                    sys.executable, "-m", "uvicorn", "main:app",
+                    "--port", str(base_port + i),
+                    "--log-level", "warning",
+                ],
+                env={
+                    **os.environ,
+                    **(env or {}),
+                    "ROUTER_WORKERS": ",".join(upstreams),
+                    "WORKER_NAME": name,
+                },
+            )
+        )
+    return processes, upstreams
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("ROUTER_WORKER_COUNT", "0"))
+        or os.cpu_count(),
+    )
+    parser.add_argument("--worker-port", type=int, default=8100)
+    parser.add_argument(
+        "--upstream",
+        action="append",
+        metavar="NAME=URL",
+        help="route to an already running worker instead of starting them; "
+        "each worker needs WORKER_NAME and the same ROUTER_WORKERS list",
+    )
+    args = parser.parse_args(argv)
+
+    processes = []
+    if args.upstream:
+        upstreams = dict(u.split("=", 1) for u in args.upstream)
+    else:
+        processes, upstreams = spawn_workers(args.workers, args.worker_port)
+    try:
+        web.run_app(make_app(upstreams), host=args.host, port=args.port, access_log=None)
+    finally:
+        for p in processes:
+            p.terminate()
+        for p in processes:
+            p.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""Runs conversations against the server in-process, with a scripted stand-in
+for the LLM and for Daily Bots, to try out call trees without placing calls.
+
+Each simulated conversation POSTs /start, then plays the LLM: it calls one
+of the tools the current page offers (the bot config's initial tools, then
+each webhook response's set_context tools) until the call tree reaches a
+final page or offers no tools. With --replay, conversations instead send the
+function calls recorded in a JSONL file, either `{"calls": [{"function_name":
+..., "arguments": {...}, "at": seconds}]}` lines or the server's own JSON
+logs, at --speed times real time.
+
+Reports which pages and transitions were covered, which pages conversations
+ended on, and any function calls the tree didn't allow or pages it got
+stuck on.
+
+    python -m simulator --conversations 5000 --concurrency 500
+    python -m simulator --replay server.log --speed 50
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+
+WEBHOOK_LOG_PREFIX = "Webhook function call: "
+
+
+class SimulatedLauncher:
+    """Stands in for main.launcher, answering /start without starting a bot and
+    remembering the tools each conversation's bot would start with."""
+
+    def __init__(self):
+        self.initial_tools = {}
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def start(self, bot_config, on_sending=None):
+        if on_sending is not None:
+            on_sending()
+        bot_config = json.loads(bot_config)
+        conversation_id = bot_config["webhook_tools"]["*"]["custom_headers"][
+            "conversation-id"
+        ]
+        llm = next(c for c in bot_config["config"] if c["service"] == "llm")
+        tools = next(o["value"] for o in llm["options"] if o["name"] == "tools")
+        self.initial_tools[conversation_id] = tools
+        return {"room_url": f"https://simulated/{conversation_id}", "token": ""}
+
+
+def parse_sse(body):
+    """Returns the (event, data) of each server-sent event in a response."""
+
+    events = []
+    for chunk in body.split("\n\n"):
+        event, data = None, None
+        for line in chunk.splitlines():
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: "):
+                data = json.loads(line[6:])
+        if event:
+            events.append((event, data))
+    return events
+
+
+def offered_tools(events):
+    """The tools a response's set_context gives the LLM, or None if it doesn't
+    change them."""
+
+    for event, data in events:
+        if event == "action" and data.get("action") == "set_context":
+            return next(a["value"] for a in data["arguments"] if a["name"] == "tools")
+    return None
+
+
+def error_result(events):
+    """The error a response's function result gives the LLM, or None."""
+
+    for event, data in events:
+        if event == "action" and data.get("action") == "function_result":
+            for a in data["arguments"]:
+                if a["name"] == "result" and isinstance(a["value"], dict):
+                    return a["value"].get("error")
+    return None
+
+
+def tool_arguments(tool, rng):
+    """Makes up arguments that satisfy a tool's schema."""
+
+    parameters = tool["function"]["parameters"]
+    arguments = {}
+    for name in parameters.get("required", []):
+        schema = parameters["properties"].get(name, {})
+        if "enum" in schema:
+            arguments[name] = rng.choice(schema["enum"])
+        elif schema.get("type") in ("integer", "number"):
+            arguments[name] = rng.randint(1, 10)
+        elif schema.get("type") == "boolean":
+            arguments[name] = rng.random() < 0.5
+        else:
+            arguments[name] = f"simulated {name}"
+    return arguments
+
+
+class ScriptedLLM:
+    """Picks which of the offered tools to call. Tools named in `weights` are
+    picked in proportion to their weight, others with weight 1."""
+
+    def __init__(self, seed=0, weights=None):
+        self.rng = random.Random(seed)
+        self.weights = weights or {}
+
+    def call(self, tools):
+        tool = self.rng.choices(
+            tools, [self.weights.get(t["function"]["name"], 1) for t in tools]
+        )[0]
+        return tool["function"]["name"], tool_arguments(tool, self.rng)
+
+
+def load_recordings(path):
+    """Reads recorded conversations as lists of {"function_name", "arguments",
+    "at"} calls, from `{"calls": [...]}` lines or the server's JSON logs."""
+
+    recorded = []
+    logged = defaultdict(dict)
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if "calls" in entry:
+                recorded.append(entry["calls"])
+            elif entry.get("msg", "").startswith(WEBHOOK_LOG_PREFIX):
+                # Retried webhooks are logged again; keep the first.
+                logged[entry.get("conversation_id")].setdefault(
+                    entry.get("tool_call_id"),
+                    {
+                        "function_name": entry["msg"][len(WEBHOOK_LOG_PREFIX):],
+                        "arguments": entry.get("arguments", {}),
+                        "at": entry.get("ts", 0),
+                    },
+                )
+    for calls in logged.values():
+        calls = list(calls.values())
+        start = calls[0]["at"]
+        recorded.append([{**c, "at": c["at"] - start} for c in calls])
+    return recorded
+
+
+class Report:
+    def __init__(self, tree):
+        self.tree = tree
+        self.conversations = 0
+        self.webhooks = 0
+        self.nodes = Counter()
+        self.transitions = Counter()
+        self.endings = Counter()
+        self.invalid = Counter()
+        self.dead_ends = Counter()
+        self.errors = []
+
+    def coverage(self):
+        nodes = [s.id for s in self.tree.states]
+        edges = [
+            (s.id, t.event, t.target.id)
+            for s in self.tree.states
+            for t in s.transitions
+        ]
+        return (
+            [n for n in nodes if n not in self.nodes],
+            [e for e in edges if e not in self.transitions],
+            len(nodes),
+            len(edges),
+        )
+
+    def print(self, elapsed):
+        missed_nodes, missed_edges, node_count, edge_count = self.coverage()
+        print(
+            f"conversations  {self.conversations} "
+            f"({self.webhooks} webhooks in {elapsed:.1f}s)"
+        )
+        print(f"pages          {node_count - len(missed_nodes)}/{node_count} visited")
+        for node in missed_nodes:
+            print(f"  never visited: {node}")
+        print(
+            f"transitions    {edge_count - len(missed_edges)}/{edge_count} taken"
+        )
+        for source, event, target in missed_edges:
+            print(f"  never taken: {source} --{event}--> {target}")
+        print("ended on")
+        for node, count in sorted(self.endings.items()):
+            print(f"  {node:<12} {count}")
+        if self.invalid:
+            print("invalid function calls")
+            for (node, event), count in self.invalid.most_common():
+                print(f"  {event} on {node}: {count}")
+        if self.dead_ends:
+            print("stuck on pages without tools")
+            for node, count in self.dead_ends.most_common():
+                print(f"  {node}: {count}")
+        for error in self.errors[:5]:
+            print(f"  error: {error}")
+
+
+async def conversation(app, client, launcher, report, llm=None, calls=None, speed=0):
+    """Runs one conversation, with `llm` choosing the calls or replaying `calls`."""
+
+    r = await client.post("/start", json={"dialout": "+15555550100"})
+    if r.status_code != 200:
+        report.errors.append(f"/start {r.status_code}: {r.text[:200]}")
+        return
+    conversation_id = r.json()["room_url"].rsplit("/", 1)[1]
+    tools = launcher.initial_tools.pop(conversation_id)
+    report.conversations += 1
+    state = await app.conversation_state(conversation_id)
+    report.nodes[state.id] += 1
+
+    started = time.monotonic()
+    for i in itertools.count():
+        if state.final:
+            break
+        if calls is not None:
+            if i >= len(calls):
+                break
+            call = calls[i]
+            name, arguments = call["function_name"], call.get("arguments", {})
+            if speed:
+                delay = started + call.get("at", 0) / speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        elif not tools:
+            report.dead_ends[state.id] += 1
+            break
+        else:
+            name, arguments = llm.call(tools)
+
+        r = await client.post(
+            "/webhook",
+            json={
+                "function_name": name,
+                "tool_call_id": f"{conversation_id}-{i}",
+                "arguments": arguments,
+            },
+            headers={"conversation-id": conversation_id},
+        )
+        report.webhooks += 1
+        events = parse_sse(r.text)
+        if r.status_code != 200 or error_result(events) is not None:
+            report.invalid[(state.id, name)] += 1
+            if calls is None:
+                break
+            continue
+        target = await app.conversation_state(conversation_id)
+        report.transitions[(state.id, name, target.id)] += 1
+        report.nodes[target.id] += 1
+        state = target
+        tools = offered_tools(events) or []
+
+    report.endings[state.id] += 1
+
+
+async def run(args):
+    import httpx
+
+    import main as app
+    from call_tree import get_call_tree
+    from dispositions import DispositionSink
+
+    launcher = SimulatedLauncher()
+    app.launcher = launcher
+    app.disposition_sink = DispositionSink(args.dispositions_db)
+    tree = get_call_tree(args.tree)
+    report = Report(getattr(tree, "definition", tree))
+    weights = {k: float(v) for k, v in (w.split("=", 1) for w in args.weight or ())}
+    llm = ScriptedLLM(args.seed, weights)
+    if args.replay:
+        recorded = load_recordings(args.replay)
+        count = args.conversations or len(recorded)
+        scripts = [recorded[i % len(recorded)] for i in range(count)]
+    else:
+        scripts = [None] * (args.conversations or 1000)
+
+    transport = httpx.ASGITransport(app=app.app, raise_app_exceptions=False)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    async with app.lifespan(app.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://simulator") as client:
+
+            async def bounded(calls):
+                async with semaphore:
+                    try:
+                        await conversation(
+                            app, client, launcher, report, llm, calls, args.speed
+                        )
+                    except Exception as e:
+                        report.errors.append(repr(e))
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(bounded(calls) for calls in scripts))
+            elapsed = time.perf_counter() - t0
+    return report, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--conversations", type=int,
+        help="how many to run (default: 1000, or each recording once)",
+    )
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--tree", help="call tree to simulate (default: CALL_TREE)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--weight",
+        action="append",
+        metavar="FUNCTION=WEIGHT",
+        help="make the LLM call a function more or less often than others",
+    )
+    parser.add_argument("--replay", help="JSONL file of recorded conversations")
+    parser.add_argument(
+        "--speed", type=float, default=0,
+        help="replay at this many times real time (0: as fast as possible)",
+    )
+    parser.add_argument("--dispositions-db", default=":memory:")
+    args = parser.parse_args(argv)
+
+    # main reads these at import.
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if args.tree:
+        os.environ["CALL_TREE"] = args.tree
+
+    report, elapsed = asyncio.run(run(args))
+    report.print(elapsed)
+    sys.exit(1 if report.invalid or report.dead_ends or report.errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import json
+import re
+
+# Per-call values are written into message templates as ${field} placeholders.
+PLACEHOLDER = re.compile(r"\$\{(\w+)\}")
+
+CLOSE = b"data:close\n\n"
+
+
+def encode_event(event, data):
+    """Formats one RTVI message as a server-sent event."""
+
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+def escape_values(values):
+    """JSON-escapes per-call string values so they can be spliced into templates."""
+
+    return {k: json.dumps(v)[1:-1].encode() for k, v in values.items()}
+
+
+def fill(data, values):
+    """Returns a copy of a message template with its placeholders filled in."""
+
+    if isinstance(data, str):
+        return PLACEHOLDER.sub(lambda m: values[m.group(1)], data)
+    if isinstance(data, dict):
+        return {k: fill(v, values) for k, v in data.items()}
+    if isinstance(data, list):
+        return [fill(v, values) for v in data]
+    return data
+
+
+class SSETemplate:
+    """An RTVI message serialized to server-sent event bytes once, up front.
+
+    Placeholders are left as gaps in the serialized bytes, and `render`
+    splices each call's escaped values into those gaps instead of building
+    and encoding the message dict again.
+    """
+
+    __slots__ = ("event", "data", "_parts")
+
+    def __init__(self, event, data):
+        self.event = event
+        self.data = data
+        parts = PLACEHOLDER.split(encode_event(event, data).decode())
+        # Even indexes are literal bytes, odd indexes are placeholder names.
+        self._parts = tuple(
+            p.encode() if i % 2 == 0 else p for i, p in enumerate(parts)
+        )
+
+    def render(self, values):
+        parts = self._parts
+        if len(parts) == 1:
+            return parts[0]
+        return b"".join(p if i % 2 == 0 else values[p] for i, p in enumerate(parts))
+
+    def message(self, values):
+        """Rebuilds the message dict, for logging and debugging."""
+
+        return {self.event: fill(self.data, values)}
+
+
+class SSEResponse:
+    """The events for one webhook response.
+
+    Events are rendered one at a time as the response is streamed, so the
+    first event goes out before the later, larger ones are built.
+    """
+
+    __slots__ = ("templates", "values")
+
+    def __init__(self, templates, values):
+        self.templates = templates
+        self.values = values
+
+    def __iter__(self):
+        for t in self.templates:
+            yield t.render(self.values)
+
+
+def compile_messages(messages):
+    """Compiles a list of {event: data} RTVI messages into SSE templates."""
+
+    return tuple(SSETemplate(k, v) for m in messages for k, v in m.items())
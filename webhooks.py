@@ -0,0 +1,101 @@
+"""Parsing the bot's function call webhooks, and the responses to ones that
+can't be handled.
+
+/webhook and /language read their request bodies themselves instead of having
+FastAPI validate a Pydantic model: the body is decoded once (with orjson when
+it's installed) into a FunctionCall, and a call that can't be handled gets an
+error response compiled at import, with only the tool call spliced in.
+"""
+
+from sse import CLOSE, compile_messages, escape_values
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+
+class InvalidFunctionCall(ValueError):
+    pass
+
+
+class FunctionCall:
+    """A function call the bot's LLM made, from a webhook body."""
+
+    __slots__ = ("function_name", "tool_call_id", "arguments")
+
+    def __init__(self, function_name, tool_call_id, arguments):
+        self.function_name = function_name
+        self.tool_call_id = tool_call_id
+        self.arguments = arguments
+
+    @classmethod
+    def parse(cls, body):
+        """Decodes and checks a webhook body, raising InvalidFunctionCall if it
+        isn't a function call."""
+
+        try:
+            data = loads(body)
+        except ValueError:
+            raise InvalidFunctionCall("Body isn't valid JSON") from None
+        if not isinstance(data, dict):
+            raise InvalidFunctionCall("Body isn't a JSON object")
+        function_name = data.get("function_name")
+        tool_call_id = data.get("tool_call_id")
+        arguments = data.get("arguments")
+        if not isinstance(function_name, str) or not isinstance(tool_call_id, str):
+            raise InvalidFunctionCall("function_name and tool_call_id must be strings")
+        if not isinstance(arguments, dict):
+            raise InvalidFunctionCall("arguments must be an object")
+        return cls(function_name, tool_call_id, arguments)
+
+
+def error_messages(error):
+    """The RTVI message that answers a function call with an error for the LLM."""
+
+    return [
+        {
+            "action": {
+                "service": "llm",
+                "action": "function_result",
+                "arguments": [
+                    {"name": "function_name", "value": "${function_name}"},
+                    {"name": "tool_call_id", "value": "${tool_call_id}"},
+                    {"name": "arguments", "value": {}},
+                    {"name": "result", "value": {"error": error}},
+                ],
+            }
+        }
+    ]
+
+
+# Compiled response for each reason a call can't be handled. They're sent with
+# status 200, since the bot only hands the LLM the result of a successful
+# response; the error is in the result for the LLM to act on.
+ERRORS = {
+    "invalid_request": compile_messages(
+        error_messages("The function call couldn't be read.")
+    ),
+    "unknown_conversation": compile_messages(
+        error_messages("This call has already ended.")
+    ),
+    "not_allowed": compile_messages(
+        error_messages(
+            "That function can't be called at this point in the conversation. "
+            "Only call the functions you currently have."
+        )
+    ),
+    "unsupported_language": compile_messages(
+        error_messages("That language isn't supported. Keep speaking the current language.")
+    ),
+}
+
+
+def error_response(reason, call=None):
+    """The whole SSE body answering `call` with an error."""
+
+    values = {"function_name": "", "tool_call_id": ""}
+    if call is not None:
+        values = {"function_name": call.function_name, "tool_call_id": call.tool_call_id}
+    values = escape_values(values)
+    return b"".join([*(t.render(values) for t in ERRORS[reason]), CLOSE])